@@ -0,0 +1,279 @@
+from Conduct_Interviews import *
+from langchain_core.callbacks import BaseCallbackHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import queue
+import threading
+import time
+
+# Analyst review that does not hold up the interviews
+#
+# run_graph waits for every round of feedback before any interview starts. review_and_interview starts the interviews
+# of the first draft right away and takes feedback in the background, from the console, a file, an in-process queue or
+# a local HTTP endpoint. After each revision, interviews of analysts that did not change keep running; interviews of
+# analysts that were changed or dropped are cancelled (at their next node) and the new personas are interviewed.
+# Feedback written "@Name: ..." (or {"analyst": "Name", "feedback": "..."}) revises only that analyst, so the others
+# are neither regenerated nor re-interviewed.
+
+
+class InterviewCancelled(Exception):
+    """ Raised inside an interview whose analyst was revised or dropped by the review """
+
+
+class CancelInterview(BaseCallbackHandler):
+    """ Stop an interview at the start of its next step once the event is set """
+
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        if self.event.is_set():
+            raise InterviewCancelled()
+
+
+class FeedbackQueue:
+    """ Rounds of feedback put by any thread; None (or an empty round) accepts the current draft """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self.analysts = []  # Current draft, for sources that show it
+
+    def put(self, feedback):
+        self._queue.put(feedback)
+
+    def accept(self):
+        self._queue.put(None)
+
+    def get(self, timeout: float = None, until=None):
+        """ Next round of feedback, waiting at most timeout seconds or until until() is true (None, accepting the draft, when none came) """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                return self._queue.get(timeout=remaining if until is None else min(0.5, remaining or 0.5))
+            except queue.Empty:
+                if until is not None and until():
+                    return None
+
+    def idle(self) -> bool:
+        """ True once no more feedback is expected without the reviewer acting (only a file can tell) """
+        return False
+
+    def show(self, analysts: List[Analyst]):
+        """ Called with every new draft """
+        self.analysts = list(analysts)
+
+    def close(self):
+        pass
+
+
+class ConsoleFeedback(FeedbackQueue):
+    """ Feedback typed at the console, read on a background thread while the interviews run """
+
+    def __init__(self, max_feedback_loops: int = 10):
+        super().__init__()
+        self.max_feedback_loops = max_feedback_loops
+        threading.Thread(target=self._read, daemon=True, name="console-feedback").start()
+
+    def _read(self):
+        for count in range(self.max_feedback_loops):
+            try:
+                feedback = input(feedback_prompt(count, self.max_feedback_loops))
+            except EOFError:
+                feedback = ""
+            self.put(feedback)
+            if not feedback.strip():
+                return
+
+
+class FileFeedback(FeedbackQueue):
+    """ Feedback appended to a file, one round per line (plain text, "@Name: text" or a JSON object); an empty line accepts """
+
+    def __init__(self, path: str, poll_interval: float = 0.5, idle_after: float = 30.0):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.idle_after = idle_after  # Seconds without the file growing before the reviewer is taken to be done
+        self._changed_at = time.monotonic()
+        self._stop = threading.Event()
+        threading.Thread(target=self._watch, daemon=True, name="file-feedback").start()
+
+    def _watch(self):
+        position = 0
+        size = None
+        while not self._stop.is_set():
+            if os.path.exists(self.path):
+                if os.path.getsize(self.path) != size:
+                    size = os.path.getsize(self.path)
+                    self._changed_at = time.monotonic()
+                with open(self.path, encoding="utf-8") as file:
+                    file.seek(position)
+                    while True:
+                        line = file.readline()
+                        if not line.endswith("\n"):
+                            break  # Wait for the rest of a line still being written
+                        position = file.tell()
+                        line = line.strip()
+                        self.put(json.loads(line) if line.startswith("{") else line)
+            self._stop.wait(self.poll_interval)
+
+    def idle(self) -> bool:
+        return self._queue.empty() and time.monotonic() - self._changed_at >= self.idle_after
+
+    def close(self):
+        self._stop.set()
+
+
+class HttpFeedback(FeedbackQueue):
+    """ Local HTTP endpoint for the review:
+    GET /analysts returns the current draft, POST /feedback takes a round (text, or JSON {"feedback", "analyst"}),
+    POST /accept accepts the draft """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+        super().__init__()
+        source = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != "/analysts":
+                    return self._reply(404, {"error": "not found"})
+                self._reply(200, [analyst.dict() for analyst in source.analysts])
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+                if self.path == "/accept":
+                    source.accept()
+                    return self._reply(202, {"accepted": True})
+                if self.path != "/feedback":
+                    return self._reply(404, {"error": "not found"})
+                feedback = json.loads(body) if body.lstrip().startswith("{") else body
+                if not parse_feedback(feedback)[1]:
+                    return self._reply(400, {"error": "empty feedback, POST /accept to accept the draft"})
+                source.put(feedback)
+                self._reply(202, {"queued": True})
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="http-feedback").start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def release_cancelled_interview(analyst: Analyst, thread_id: str):
+    """ Drop the checkpoints and prefetched searches of a cancelled interview: its persona is never interviewed again """
+    graph = get_interview_graph()
+    config = {"configurable": {"thread_id": interview_thread_id(thread_id, analyst)}}
+    interview_id = graph.get_state(config).values.get("interview_id")
+    if interview_id:
+        release_prefetches(interview_id)
+    release_thread(graph, config)
+
+
+def make_feedback_source(spec: str) -> FeedbackQueue:
+    """ Feedback source from a setting: "console", "http://127.0.0.1:8765", or the path of a feedback file """
+    if spec == "console":
+        return ConsoleFeedback()
+    if spec.startswith("http://"):
+        host, _, port = spec[len("http://"):].rstrip("/").partition(":")
+        return HttpFeedback(host or "127.0.0.1", int(port or 8765))
+    return FileFeedback(spec)
+
+
+def review_and_interview(topic, max_analysts, max_questions, thread_id, llm_model, llm_temperature, feedback_source: FeedbackQueue,
+                         max_concurrency=4, sinks=None, max_feedback_loops=10, review_timeout=None):
+    """ Generate the analysts and run their interviews, starting each interview as soon as its analyst is drafted
+    and taking the review feedback from feedback_source meanwhile. Returns (final analysts, reports by analyst name) """
+
+    get_run_archive().start_run(thread_id, topic, llm_model=llm_model, llm_temperature=llm_temperature)
+    graph = get_analysts_graph()
+    thread = {"configurable": {"thread_id": thread_id, **llm_config(llm_model, llm_temperature)}, "callbacks": list(graph_callbacks)}
+
+    running = {}  # Fingerprint -> (analyst, future, cancel event)
+    counts = {"started": 0, "kept": 0, "cancelled": 0}
+
+    def interview(analyst, cancel):
+        try:
+            return conduct_interview_with_analyst(analyst, topic, max_questions, thread_id, llm_model, llm_temperature, sinks,
+                                                  callbacks=[CancelInterview(cancel)])
+        except InterviewCancelled:
+            release_cancelled_interview(analyst, thread_id)
+            raise
+
+    def follow(analysts):
+        """ Keep the interviews of unchanged analysts, cancel the others and start the new ones """
+        fingerprints = {analyst_fingerprint(analyst) for analyst in analysts}
+        for fingerprint in list(running):
+            if fingerprint not in fingerprints:
+                analyst, future, cancel = running.pop(fingerprint)
+                cancel.set()
+                future.cancel()
+                counts["cancelled"] += 1
+                print(f"[Review] {analyst.name} was revised or dropped: interview cancelled")
+        for analyst in analysts:
+            fingerprint = analyst_fingerprint(analyst)
+            if fingerprint in running:
+                continue
+            cancel = threading.Event()
+            running[fingerprint] = (analyst, executor.submit(interview, analyst, cancel), cancel)
+            counts["started"] += 1
+        feedback_source.show(analysts)
+
+    def review_over():
+        # Nothing is left to revise once every interview finished and the feedback source went quiet
+        return all(future.done() for _, future, _ in running.values()) and feedback_source.idle()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        # First draft: its interviews start while it is being reviewed
+        for event in graph.stream({"topic": topic, "max_analysts": max_analysts, "human_analyst_feedback": ""}, thread, stream_mode="values"):
+            analysts = event.get('analysts', '')
+        print_analysts("FIRST DRAFT", analysts)
+        follow(analysts)
+
+        for _ in range(max_feedback_loops):
+            target_analyst, human_feedback = parse_feedback(feedback_source.get(review_timeout, until=review_over))
+            if not human_feedback:
+                break
+
+            graph.update_state(thread, {"human_analyst_feedback": human_feedback, "target_analyst": target_analyst}, as_node="human_feedback")
+            for event in graph.stream(None, thread, stream_mode="values"):
+                pass
+            analysts = graph.get_state(thread).values.get('analysts')
+            print_analysts(f"REVISED DRAFT WITH HUMAN FEEDBACK{f' FOR {target_analyst.upper()}' if target_analyst else ''}", analysts)
+            follow(analysts)
+
+        feedback_source.close()
+        print_analysts("FINAL LIST", analysts)
+        save_analysts(analysts, thread_id)
+        release_thread(graph, thread)
+
+        counts["kept"] = len(running)
+        reports = {}
+        for analyst, future, _ in running.values():
+            try:
+                reports[analyst.name] = future.result()
+            except Exception as e:
+                print(f"Interview with {analyst.name} failed: {e!r}")
+
+    # Sections an interview archived before its analyst was dropped stay in the archive; the report uses the final analysts
+    release_document_store(topic)
+    print(f"[Review] {counts['started']} interview(s) started, {counts['kept']} kept, {counts['cancelled']} cancelled by revisions")
+
+    return analysts, reports
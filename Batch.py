@@ -0,0 +1,166 @@
+from Conduct_Interviews import *
+from Write_Report import write_report
+from Run_Archive import configure_run_archive, export_run
+from concurrent.futures import FIRST_COMPLETED, wait
+import argparse
+import csv
+import os
+import re
+import time
+
+# Batch mode: many research topics in one process, with all interviews sharing one worker pool
+#
+# Topics file, JSONL:  {"topic": "...", "max_analysts": 3, "max_questions": 4, "feedback": ["..."]}
+#              or CSV: topic,max_analysts,max_questions,feedback   (feedback rounds separated by "|")
+# Feedback file (optional): {"<topic>": ["first round of feedback", "second round", ...], ...}
+
+
+def read_topics(path: str, max_analysts: int = 3, max_questions: int = 3) -> List[dict]:
+    """ Read topics from a JSONL or CSV file, filling in the default limits """
+    with open(path, encoding="utf-8") as file:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = [json.loads(line) for line in file if line.strip()]
+
+    topics = []
+    for row in rows:
+        feedback = row.get("feedback")
+        if isinstance(feedback, str):
+            feedback = [answer.strip() for answer in feedback.split("|") if answer.strip()] or None
+        topics.append({
+            "topic": row["topic"],
+            "max_analysts": int(row.get("max_analysts") or max_analysts),
+            "max_questions": int(row.get("max_questions") or max_questions),
+            "feedback": feedback,
+        })
+    return topics
+
+
+def topic_dir(output_dir: str, index: int, topic: str) -> str:
+    """ Output folder of a topic's rendered report """
+    slug = re.sub(r"[^a-z0-9]+", "_", topic.lower()).strip("_")[:60]
+    return os.path.join(output_dir, f"{index:03d}_{slug}")
+
+
+def run_batch(topics_file: str, llm_model: str, llm_temperature: float, max_concurrency: int = 8,
+              output_dir: str = "batch_output", feedback_file: str = None, max_analysts: int = 3, max_questions: int = 3) -> dict:
+    """ Generate analysts for every topic without prompting, run all interviews in one pool, and write a manifest """
+
+    topics = read_topics(topics_file, max_analysts, max_questions)
+    feedback_by_topic = {}
+    if feedback_file:
+        with open(feedback_file, encoding="utf-8") as file:
+            feedback_by_topic = json.load(file)
+
+    # All topics are archived in one file, indexed by run, topic and analyst
+    os.makedirs(output_dir, exist_ok=True)
+    archive_file = os.path.join(output_dir, "run_archive.sqlite")
+    configure_run_archive(archive_file)
+
+    started = time.time()
+    entries = []
+    for index, item in enumerate(topics):
+        item_dir = topic_dir(output_dir, index, item["topic"])
+        os.makedirs(item_dir, exist_ok=True)
+        entries.append({
+            "topic": item["topic"],
+            "thread_id": str(uuid.uuid4()),
+            "output_dir": item_dir,
+            "max_analysts": item["max_analysts"],
+            "max_questions": item["max_questions"],
+            "final_report": None,
+            "reports": {},
+            "failed": {},
+            "timings": {},
+        })
+
+    def generate(entry, feedback):
+        start = time.time()
+        analysts = run_graph(entry["topic"], entry["max_analysts"], llm_model, llm_temperature, entry["thread_id"],
+                             feedback=feedback)
+        entry["timings"]["analysts"] = time.time() - start
+        return analysts
+
+    def report(entry):
+        start = time.time()
+        markdown = write_report(entry["topic"], entry["thread_id"], llm_model, llm_temperature, load_analysts(entry["thread_id"]))
+        entry["timings"]["report"] = time.time() - start
+        return export_run(entry["thread_id"], os.path.join(entry["output_dir"], "final_report.md")) if markdown else None
+
+    def interview(entry, analyst):
+        start = time.time()
+        section_hash = conduct_interview_with_analyst(analyst, entry["topic"], entry["max_questions"], entry["thread_id"],
+                                                      llm_model, llm_temperature)
+        entry["timings"].setdefault("interviews", {})[analyst.name] = time.time() - start
+        return section_hash
+
+    # Analyst generation and interviews share the pool: a topic's interviews start as soon as its analysts are ready
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        pending = {}
+        for entry, item in zip(entries, topics):
+            feedback = item["feedback"] if item["feedback"] is not None else feedback_by_topic.get(item["topic"], [])
+            pending[executor.submit(generate, entry, feedback)] = (entry, None)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry, analyst = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    step = "analysts" if analyst is None else analyst if analyst == "report" else analyst.name
+                    print(f"[Batch] {entry['topic']!r} failed at {step}: {e!r}")
+                    entry["failed"][step] = repr(e)
+                    result = None
+
+                if analyst is None:
+                    if result is None:
+                        continue
+                    for next_analyst in result:
+                        pending[executor.submit(interview, entry, next_analyst)] = (entry, next_analyst)
+                elif analyst == "report":
+                    entry["final_report"] = result
+                elif result is not None:
+                    entry["reports"][analyst.name] = result
+
+                if not any(other is entry for other, _ in pending.values()):
+                    if analyst != "report" and entry["reports"]:
+                        # Every interview of the topic is done: merge their sections into the final report
+                        pending[executor.submit(report, entry)] = (entry, "report")
+                        continue
+                    entry["timings"]["total"] = time.time() - started
+                    release_document_store(entry["topic"])
+
+    manifest = {
+        "topics_file": topics_file,
+        "llm_model": llm_model,
+        "llm_temperature": llm_temperature,
+        "max_concurrency": max_concurrency,
+        "run_archive": archive_file,
+        "wall_time": time.time() - started,
+        "topics": entries,
+    }
+
+    manifest_file = os.path.join(output_dir, "manifest.json")
+    with open(manifest_file, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+
+    print(f"Batch manifest saved to {manifest_file}")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many research topics in one process")
+    parser.add_argument("topics_file", help="JSONL or CSV file of topics")
+    parser.add_argument("--feedback-file", help="JSON file mapping each topic to its rounds of analyst feedback")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--max-analysts", type=int, default=3)
+    parser.add_argument("--max-questions", type=int, default=3)
+    parser.add_argument("--llm-model", default="gpt-4o-mini")
+    parser.add_argument("--llm-temperature", type=float, default=0.5)
+    args = parser.parse_args()
+
+    run_batch(args.topics_file, args.llm_model, args.llm_temperature, args.max_concurrency, args.output_dir,
+              args.feedback_file, args.max_analysts, args.max_questions)
@@ -0,0 +1,487 @@
+from Conduct_Interviews import *
+from Retrieval_Cache import set_retriever, configure_retrieval_cache, retrievers
+from LLM_Cache import configure_llm_cache
+from Rate_Limits import RequestScheduler, configure_scheduler, scheduler_stats
+from Prefetch import configure_prefetch, prefetch_stats
+from Run_Archive import configure_run_archive
+from LLM_Clients import set_chat_model_factory
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from typing import Any, Optional
+import LLM_Clients
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+# Offline benchmark of the whole pipeline against deterministic local fakes (no OpenAI, Tavily or Wikipedia calls)
+#
+#   python Benchmark.py --analysts 1 3 5 --questions 2 5 --concurrency 1 5 --output benchmark_results.json
+#   python Benchmark.py --import-budget   (only check how fast the pipeline modules import)
+
+# Seconds a fresh interpreter may spend importing each module CLI runs and worker processes start from
+IMPORT_TIME_BUDGET = {"Conduct_Interviews": 1.5, "Batch": 1.5}
+
+_VOCABULARY = (
+    "ice cream flavour margin supply season pricing customer loyalty franchise dairy sourcing freezer logistics "
+    "gelato artisan location footfall marketing social media sustainability packaging cost staff training menu "
+    "innovation seasonal demand tourism wholesale retail parlour topping premium vegan allergen quality brand"
+).split()
+
+
+class BenchmarkRecorder:
+    """ Thread-safe counters filled by the fakes and the node timer during one scenario """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.llm_calls = {}  # node -> number of LLM calls
+        self.prompt_tokens = {}  # node -> prompt tokens sent
+        self.completion_tokens = {}  # node -> completion tokens returned
+        self.answer_prompt_tokens = {}  # interview thread -> prompt tokens of each answer_question call, in order
+        self.node_calls = {}  # node -> number of runs
+        self.node_time = {}  # node -> seconds spent in the node
+        self.retrieval_calls = {}  # source -> number of searches
+        self.cached_tokens = {}  # node -> prompt tokens served from the (fake) provider prompt cache
+
+    def record_llm(self, node, thread, prompt_tokens, completion_tokens, cached_tokens=0):
+        with self.lock:
+            self.cached_tokens[node] = self.cached_tokens.get(node, 0) + cached_tokens
+            self.llm_calls[node] = self.llm_calls.get(node, 0) + 1
+            self.prompt_tokens[node] = self.prompt_tokens.get(node, 0) + prompt_tokens
+            self.completion_tokens[node] = self.completion_tokens.get(node, 0) + completion_tokens
+            if node == "answer_question":
+                self.answer_prompt_tokens.setdefault(thread, []).append(prompt_tokens)
+
+    def record_node(self, node, seconds):
+        with self.lock:
+            self.node_calls[node] = self.node_calls.get(node, 0) + 1
+            self.node_time[node] = self.node_time.get(node, 0.0) + seconds
+
+    def record_retrieval(self, source):
+        with self.lock:
+            self.retrieval_calls[source] = self.retrieval_calls.get(source, 0) + 1
+
+    def prompt_tokens_per_turn(self) -> list:
+        """ Average answer prompt size at each turn across interviews """
+        turns = {}
+        for sizes in self.answer_prompt_tokens.values():
+            for turn, size in enumerate(sizes):
+                turns.setdefault(turn, []).append(size)
+        return [sum(sizes) / len(sizes) for _, sizes in sorted(turns.items())]
+
+    def summary(self) -> dict:
+        return {
+            "nodes": {
+                node: {
+                    "calls": self.node_calls[node],
+                    "total_time": self.node_time[node],
+                    "mean_time": self.node_time[node] / self.node_calls[node],
+                    "llm_calls": self.llm_calls.get(node, 0),
+                    "prompt_tokens": self.prompt_tokens.get(node, 0),
+                    "completion_tokens": self.completion_tokens.get(node, 0),
+                    "cached_tokens": self.cached_tokens.get(node, 0),
+                }
+                for node in sorted(self.node_calls)
+            },
+            "llm_calls": sum(self.llm_calls.values()),
+            "prompt_tokens": sum(self.prompt_tokens.values()),
+            "completion_tokens": sum(self.completion_tokens.values()),
+            "cached_tokens": sum(self.cached_tokens.values()),
+            "cache_hit_rate": sum(self.cached_tokens.values()) / max(sum(self.prompt_tokens.values()), 1),
+            "retrieval_calls": dict(self.retrieval_calls),
+            "answer_prompt_tokens_per_turn": self.prompt_tokens_per_turn(),
+        }
+
+
+class FakeRateLimitError(Exception):
+    """ What a throttled API answers: HTTP 429 """
+    status_code = 429
+
+
+class FakeServerLimit:
+    """ Server-side rate limit of a fake endpoint: requests beyond requests_per_minute in the last minute get a 429
+    (None for no limit), and so do the requests numbered in transient (1 for the first one), whatever the rate """
+
+    def __init__(self, requests_per_minute: int = None, window: float = 60.0, transient: tuple = ()):
+        self.limit = requests_per_minute
+        self.window = window
+        self.transient = set(transient)
+        self.lock = threading.Lock()
+        self.accepted = []
+        self.requests = 0
+        self.rejected = 0
+
+    def check(self):
+        with self.lock:
+            now = time.monotonic()
+            self.requests += 1
+            self.accepted = [at for at in self.accepted if now - at < self.window]
+            if self.requests in self.transient:
+                self.rejected += 1
+                raise FakeRateLimitError(f"Transient 429 on request {self.requests}")
+            if self.limit is not None and len(self.accepted) >= self.limit:
+                self.rejected += 1
+                raise FakeRateLimitError(f"Rate limit of {self.limit} requests per minute reached")
+            self.accepted.append(now)
+
+
+class FakePromptCache:
+    """ Provider-side prompt caching like OpenAI's: a prompt prefix of at least 1024 tokens seen before is served from
+    cache, in 128-token increments """
+
+    MIN_TOKENS = 1024
+    BLOCK_TOKENS = 128
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prefixes = set()
+
+    def read(self, model: str, messages) -> int:
+        """ Cached tokens of this prompt; its own prefixes are cached for the next calls """
+        text = "".join(f"{message.type}:{message.content}\n" for message in messages if isinstance(message.content, str))
+        block = self.BLOCK_TOKENS * 4
+        keys = [hashlib.sha256(f"{model}|{text[:end]}".encode("utf-8")).hexdigest() for end in range(block, len(text) + 1, block)]
+        with self.lock:
+            hits = [index for index, key in enumerate(keys) if key in self.prefixes]
+            self.prefixes.update(keys)
+        cached = (hits[-1] + 1) * self.BLOCK_TOKENS if hits else 0
+        return cached if cached >= self.MIN_TOKENS else 0
+
+
+def _words(seed: str, count: int) -> str:
+    """ Deterministic filler text """
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    return " ".join(_VOCABULARY[(digest[i % len(digest)] + i) % len(_VOCABULARY)] for i in range(count))
+
+
+class FakeChatModel(BaseChatModel):
+    """ Deterministic chat model with configurable latency and completion size. Supports structured output
+    for Perspectives, Analyst and SearchQuery, streaming, and reports token usage like a real model """
+
+    model_name: str = "fake"
+    latency: float = 0.05  # Seconds before the first token
+    token_latency: float = 0.0  # Seconds per completion token
+    completion_tokens: int = 120  # Completion size for free-text calls
+    recorder: Optional[Any] = None
+    server_limit: Optional[Any] = None  # FakeServerLimit answering 429s, like a throttled endpoint
+    prompt_cache: Optional[Any] = None  # FakePromptCache reporting cached prompt tokens
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _completion(self, messages, structured_schema) -> str:
+        system = messages[0].content if messages else ""
+        last = messages[-1].content if messages else ""
+
+        if structured_schema is Perspectives:
+            match = re.search(r"top (\d+) themes|analysts to (\d+)", system)
+            count = int(next(group for group in match.groups() if group)) if match else 3
+            return json.dumps({"analysts": [
+                {"affiliation": f"Institute {i + 1}", "name": f"Analyst {i + 1}", "role": f"{_words(system + str(i), 2)} analyst",
+                 "description": f"Focuses on {_words(system + str(i), 12)}"}
+                for i in range(count)
+            ]})
+        if structured_schema is Analyst:
+            # Targeted revision: the analyst to revise is the first persona of the prompt
+            name = re.search(r"Name: (.+)", system)
+            return json.dumps({"affiliation": "Revised Institute", "name": name.group(1).strip() if name else "Analyst", "role": f"{_words(system, 2)} analyst",
+                               "description": f"Focuses on {_words(system + last, 12)}"})
+        if structured_schema is not None:
+            return json.dumps({"search_query": " ".join(terms(last)[:6]) or "ice cream"})
+
+        # Seeded from the whole prompt: the persona (and summary, history, documents) must change the output, or every analyst runs the same interview
+        return _words("\n".join(message.content for message in messages if isinstance(message.content, str)), self.completion_tokens)
+
+    def _record(self, messages, run_manager, content):
+        if self.server_limit is not None:
+            self.server_limit.check()
+        prompt_tokens = sum(estimate_tokens(message.content) for message in messages if isinstance(message.content, str))
+        completion_tokens = estimate_tokens(content)
+        cached_tokens = min(self.prompt_cache.read(self.model_name, messages), prompt_tokens) if self.prompt_cache is not None else 0
+        if self.recorder is not None:
+            metadata = (run_manager.metadata if run_manager else None) or {}
+            self.recorder.record_llm(metadata.get("langgraph_node", "unknown"), metadata.get("thread_id", ""), prompt_tokens, completion_tokens, cached_tokens)
+        return {"input_tokens": prompt_tokens, "output_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                "input_token_details": {"cache_read": cached_tokens}}
+
+    def _generate(self, messages, stop=None, run_manager=None, structured_schema=None, **kwargs):
+        content = self._completion(messages, structured_schema)
+        usage = self._record(messages, run_manager, content)
+        time.sleep(self.latency + self.token_latency * usage["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, structured_schema=None, **kwargs):
+        content = self._completion(messages, structured_schema)
+        usage = self._record(messages, run_manager, content)
+        await asyncio.sleep(self.latency + self.token_latency * usage["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+
+    def _stream(self, messages, stop=None, run_manager=None, structured_schema=None, **kwargs):
+        content = self._completion(messages, structured_schema)
+        usage = self._record(messages, run_manager, content)
+        time.sleep(self.latency)
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.token_latency)
+            text = word if i == len(words) - 1 else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata=usage if i == 0 else None))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, structured_schema=None, **kwargs):
+        content = self._completion(messages, structured_schema)
+        usage = self._record(messages, run_manager, content)
+        await asyncio.sleep(self.latency)
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.token_latency)
+            text = word if i == len(words) - 1 else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata=usage if i == 0 else None))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs):
+        # Goes through the model like a real structured call, so caching and callbacks see it
+        return self.bind(structured_schema=schema) | RunnableLambda(lambda message: schema.model_validate_json(message.content))
+
+
+class FakeRetriever:
+    """ Canned search backend: each query term maps to a document of a fixed corpus, so related queries overlap """
+
+    def __init__(self, source: str, latency: float = 0.1, docs_per_query: int = 3, corpus_size: int = 40, doc_tokens: int = 300, recorder=None,
+                 server_limit=None):
+        self.source = source
+        self.server_limit = server_limit
+        self.latency = latency
+        self.docs_per_query = docs_per_query
+        self.corpus_size = corpus_size
+        self.doc_tokens = doc_tokens
+        self.recorder = recorder
+
+    def _documents(self, query: str) -> list:
+        if self.server_limit is not None:
+            self.server_limit.check()
+        if self.recorder is not None:
+            self.recorder.record_retrieval(self.source)
+        indexes = []
+        for term in terms(query) or [query]:
+            index = int(hashlib.sha256(term.encode("utf-8")).hexdigest(), 16) % self.corpus_size
+            if index not in indexes:
+                indexes.append(index)
+        documents = []
+        for index in indexes[:self.docs_per_query]:
+            content = _words(f"{self.source}{index}", self.doc_tokens)
+            if self.source == "web":
+                documents.append({"url": f"https://example.com/{index}", "content": content})
+            else:
+                documents.append({"source": f"https://en.wikipedia.org/wiki/Page_{index}", "page": "", "content": content})
+        return documents
+
+    def search(self, query: str) -> list:
+        time.sleep(self.latency)
+        return self._documents(query)
+
+    async def asearch(self, query: str) -> list:
+        await asyncio.sleep(self.latency)
+        return self._documents(query)
+
+
+class NodeTimer(BaseCallbackHandler):
+    """ Time every graph node run """
+
+    def __init__(self, recorder: BenchmarkRecorder):
+        self.recorder = recorder
+        self.starts = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self.starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self.starts.pop(run_id, None)
+        if started:
+            self.recorder.record_node(started[0], time.perf_counter() - started[1])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+
+def run_scenario(num_analysts: int, num_questions: int, concurrency: int, llm_latency: float = 0.05, token_latency: float = 0.0,
+                 completion_tokens: int = 120, search_latency: float = 0.1, use_async: bool = False,
+                 topic: str = "Key success factors for ice cream business", server_rpm: int = None, requests_per_minute: int = None,
+                 prefetch: bool = False) -> dict:
+    """ Run analyst generation and all interviews once against the fakes and collect the measurements.
+    With server_rpm the fakes answer 429s beyond that many requests per minute; requests_per_minute limits the schedulers.
+    With prefetch the interviews search speculatively for the next turn while the expert answers """
+
+    recorder = BenchmarkRecorder()
+    llm_limit = FakeServerLimit(server_rpm) if server_rpm else None
+    search_limit = FakeServerLimit(server_rpm) if server_rpm else None
+    prompt_cache = FakePromptCache()
+    set_chat_model_factory(lambda model, temperature: FakeChatModel(
+        model_name=model, latency=llm_latency, token_latency=token_latency, completion_tokens=completion_tokens, recorder=recorder, server_limit=llm_limit,
+        prompt_cache=prompt_cache))
+    set_retriever("web", FakeRetriever("web", search_latency, recorder=recorder, server_limit=search_limit))
+    set_retriever("wikipedia", FakeRetriever("wikipedia", search_latency, docs_per_query=2, recorder=recorder))
+
+    # Fresh schedulers, so their counters cover this scenario only
+    for name in ("llm", "web", "wikipedia"):
+        configure_scheduler(name, requests_per_minute=requests_per_minute, max_concurrency=max(concurrency, 16))
+    configure_prefetch(prefetch)
+    configure_run_archive(":memory:")
+
+    timer = NodeTimer(recorder)
+    add_graph_callback(timer)
+    thread_id = str(uuid.uuid4())
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            analysts = run_graph(topic, num_analysts, "fake", 0.0, thread_id, feedback=[])
+            analysts_time = time.perf_counter() - start
+
+            if use_async:
+                reports = asyncio.run(aconduct_interviews(analysts, topic, num_questions, thread_id, "fake", 0.0, concurrency))
+            else:
+                reports = conduct_interviews(analysts, topic, num_questions, thread_id, "fake", 0.0, concurrency)
+            wall_time = time.perf_counter() - start
+    finally:
+        remove_graph_callback(timer)
+        prefetched = prefetch_stats()
+        configure_prefetch(False)
+
+    return {
+        "analysts": num_analysts,
+        "questions": num_questions,
+        "concurrency": concurrency,
+        "async": use_async,
+        "wall_time": wall_time,
+        "analysts_time": analysts_time,
+        "interviews_time": wall_time - analysts_time,
+        "interviews_completed": len(reports),
+        "rejected_by_server": (llm_limit.rejected + search_limit.rejected) if server_rpm else 0,
+        "schedulers": scheduler_stats(),
+        "prefetch": prefetched,
+        **recorder.summary(),
+    }
+
+
+def measure_import_time(module: str, runs: int = 3) -> float:
+    """ Best wall time, over a few runs, of importing a module in a fresh interpreter """
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    times = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def check_import_budget(budget: dict = None, runs: int = 3) -> dict:
+    """ Measure the import time of every budgeted module; "ok" is False when any of them is over budget """
+    budget = budget or IMPORT_TIME_BUDGET
+    modules = {}
+    for module, limit in budget.items():
+        seconds = measure_import_time(module, runs)
+        modules[module] = {"seconds": seconds, "budget": limit, "ok": seconds <= limit}
+        print(f"import {module}: {seconds:.2f}s (budget {limit:.2f}s){'' if seconds <= limit else ' OVER BUDGET'}")
+    return {"ok": all(item["ok"] for item in modules.values()), "modules": modules}
+
+
+def check_rate_recovery(requests: int = 160, requests_per_minute: int = 500, time_limit: float = 60.0) -> dict:
+    """ A single transient 429 must not collapse a scheduler's request rate: send requests through a fresh scheduler, with
+    requests_per_minute configured (429 on the 10th request) and without (429 on the first two, before any success).
+    "ok" is False when the rate is not back where it started by the end, or the requests take longer than time_limit """
+    cases = {}
+    for name, configured, transient in (("configured", requests_per_minute, (10,)), ("unconfigured", None, (1, 2))):
+        scheduler = RequestScheduler(f"check_{name}", requests_per_minute=configured)
+        server = FakeServerLimit(transient=transient)
+        lowest = float("inf")
+        start = time.perf_counter()
+        for _ in range(requests):
+            scheduler.call(server.check)
+            rate = scheduler.stats()["requests_per_minute"]
+            lowest = min(lowest, rate if rate is not None else float("inf"))
+        seconds = time.perf_counter() - start
+        final = scheduler.stats()["requests_per_minute"]
+        ok = final == configured and seconds <= time_limit
+        cases[name] = {"seconds": seconds, "lowest_rate": None if lowest == float("inf") else lowest, "final_rate": final,
+                       "rejected": server.rejected, "ok": ok}
+        print(f"{name}: {requests} requests in {seconds:.1f}s, lowest rate {cases[name]['lowest_rate']}, final rate {final}{'' if ok else ' FAILED'}")
+    return {"ok": all(case["ok"] for case in cases.values()), "cases": cases}
+
+
+def run_benchmark(analyst_counts, question_counts, concurrency_levels, output: str = "benchmark_results.json", **options) -> dict:
+    """ Run every combination of the matrix and write the results as JSON """
+
+    # Measure the pipeline itself: no response or retrieval caches, fakes instead of the real backends
+    configure_llm_cache("off")
+    configure_retrieval_cache(enabled=False)
+    saved_factory, saved_retrievers = LLM_Clients.chat_model_factory, dict(retrievers)
+
+    scenarios = []
+    try:
+        for num_analysts in analyst_counts:
+            for num_questions in question_counts:
+                for concurrency in concurrency_levels:
+                    result = run_scenario(num_analysts, num_questions, concurrency, **options)
+                    print(f"analysts={num_analysts} questions={num_questions} concurrency={concurrency}: "
+                          f"{result['wall_time']:.2f}s, {result['llm_calls']} LLM calls, {result['prompt_tokens']} prompt tokens")
+                    scenarios.append(result)
+    finally:
+        set_chat_model_factory(saved_factory)
+        retrievers.update(saved_retrievers)
+
+    results = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "options": options, "scenarios": scenarios}
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=4)
+    print(f"Benchmark results saved to {output}")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the analyst and interview graphs")
+    parser.add_argument("--analysts", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--questions", type=int, nargs="+", default=[2, 5])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds before the first token of each LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds per completion token")
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--server-rpm", type=int, help="make the fake LLM and web search answer 429s beyond this many requests per minute")
+    parser.add_argument("--rpm", type=int, dest="requests_per_minute", help="requests per minute allowed by the schedulers")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the async interview path")
+    parser.add_argument("--prefetch", action="store_true", help="search speculatively for the next turn while the expert answers")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--import-budget", nargs="?", type=float, const=-1.0, metavar="SECONDS",
+                        help="only check the import time budget (optionally overriding it for every module) and exit non-zero when it is exceeded")
+    parser.add_argument("--check-rate-recovery", action="store_true",
+                        help="only check that the schedulers recover from a single transient 429, and exit non-zero when they do not")
+    args = parser.parse_args()
+
+    if args.check_rate_recovery:
+        sys.exit(0 if check_rate_recovery()["ok"] else 1)
+
+    if args.import_budget is not None:
+        budget = {module: args.import_budget for module in IMPORT_TIME_BUDGET} if args.import_budget > 0 else None
+        sys.exit(0 if check_import_budget(budget)["ok"] else 1)
+
+    run_benchmark(args.analysts, args.questions, args.concurrency, args.output,
+                  llm_latency=args.llm_latency, token_latency=args.token_latency, completion_tokens=args.completion_tokens,
+                  search_latency=args.search_latency, use_async=args.use_async, server_rpm=args.server_rpm,
+                  requests_per_minute=args.requests_per_minute, prefetch=args.prefetch)
@@ -0,0 +1,60 @@
+import sqlite3
+from langgraph.checkpoint.memory import MemorySaver
+
+# Checkpointers for the analyst and interview graphs
+
+
+def make_checkpointer(path: str = None):
+    """ In-memory checkpointer, or a durable SQLite one when a file path is given """
+    if not path:
+        return MemorySaver()
+
+    # Requires the langgraph-checkpoint-sqlite package
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+# What happens to a thread's checkpoints once its output has been saved:
+# "delete" frees them, "latest" keeps only the final state, "keep" keeps the full history
+CHECKPOINT_RETENTION_POLICIES = ("delete", "latest", "keep")
+checkpoint_retention = "delete"
+
+
+def set_checkpoint_retention(policy: str):
+    """ Choose how finished threads are pruned """
+    global checkpoint_retention
+    if policy not in CHECKPOINT_RETENTION_POLICIES:
+        raise ValueError(f"Checkpoint retention must be one of {CHECKPOINT_RETENTION_POLICIES}, got {policy!r}")
+    checkpoint_retention = policy
+
+
+def release_thread(graph, config, as_node: str = None):
+    """ Prune the checkpoints of a finished thread according to checkpoint_retention """
+    if checkpoint_retention == "keep" or graph.checkpointer is None:
+        return
+
+    thread_id = config["configurable"]["thread_id"]
+
+    if checkpoint_retention == "latest" and as_node:
+        # Replace the history with a single checkpoint holding the final state
+        values = graph.get_state(config).values
+        graph.checkpointer.delete_thread(thread_id)
+        graph.update_state(config, values, as_node=as_node)
+    else:
+        graph.checkpointer.delete_thread(thread_id)
+
+
+async def arelease_thread(graph, config, as_node: str = None):
+    """ Async version of release_thread """
+    if checkpoint_retention == "keep" or graph.checkpointer is None:
+        return
+
+    thread_id = config["configurable"]["thread_id"]
+
+    if checkpoint_retention == "latest" and as_node:
+        values = (await graph.aget_state(config)).values
+        await graph.checkpointer.adelete_thread(thread_id)
+        await graph.aupdate_state(config, values, as_node=as_node)
+    else:
+        await graph.checkpointer.adelete_thread(thread_id)
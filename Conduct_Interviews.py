@@ -2,22 +2,38 @@ import operator
 from typing import Annotated
 from langgraph.graph import MessagesState
 from langchain_core.messages import get_buffer_string
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_community.document_loaders import WikipediaLoader
 from Generate_Analysts import *
+from Context_Window import *
+from Checkpoints import release_thread, arelease_thread
+from Streaming import is_streaming, stream_graph, astream_graph
+from Instrumentation import instrument
+from LLM_Clients import chat_model, llm_config
+from Early_Exit import turn_novelty, stopped_early
+from Document_Store import get_document_store, release_document_store, chunk_context, documents_shared
+from Message_History import recent_history, compact_history, acompact_history
+from Prefetch import prefetch, aprefetch, prefetched_search, aprefetched_search, release_prefetches
+from Write_Report import save_section
+from Run_Archive import archive_turn, archive_interview
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import functools
 import uuid
-import markdown
-
-# Load environment variables from the .env file
-load_dotenv()
 
 class InterviewState(MessagesState):
     interview_id: str  # ID of the interview
+    run_id: str  # Thread of the run, which keys its records in the run archive
+    topic: str  # Research topic, which scopes the shared document store
     max_num_questions: int  # Number turns of conversation
     num_responses: int  # Number answers so far
-    context: Annotated[list, operator.add]  # Source docs
+    context_token_budget: int  # Optional override of the token budget for answer context
+    context: Annotated[list, merge_documents]  # Source docs, one copy each, with stable citation numbers
+    novelty: Annotated[list, operator.add]  # Information gain of each turn (new documents, answer overlap)
+    early_exit_threshold: float  # Optional override of the gain below which the interview stops early
     analyst: Analyst  # Analyst asking questions
+    search_query: str  # Search query for the current question, shared by all retrievers
     conduct_interview: str  # Interview transcript
+    summary: str  # Running summary of the messages that fell out of the verbatim window
+    summarized: int  # Number of leading messages folded into the summary
     sections: list  # Final key we duplicate in outer state for Send() API
 
 
@@ -26,7 +42,10 @@ class SearchQuery(BaseModel):
 
 
 
-question_instructions = """You are {name}, an analyst tasked with interviewing an expert to learn about a specific topic. 
+# Prompts are laid out for provider prompt caching: the fixed instructions first (byte-identical for every analyst and
+# turn), then the persona, the conversation, and the documents last
+
+question_instructions = """You are an analyst tasked with interviewing an expert to learn about a specific topic. 
 
 Your goal is boil down to interesting and specific insights related to your topic.
 
@@ -34,7 +53,7 @@ Your goal is boil down to interesting and specific insights related to your topi
 
 2. Specific: Insights that avoid generalities and include specific examples from the expert.
 
-Here is your topic of focus and set of goals: {goals}
+Your name, topic of focus and set of goals are given after these instructions.
 
 Begin by introducing yourself using a name that fits your persona, and then ask your question.
 
@@ -44,25 +63,43 @@ When you are satisfied with your understanding, complete the interview with: "Th
 
 Remember to stay in character throughout your response, reflecting the persona and goals provided to you."""
 
+question_persona = """You are {name}.
+
+Here is your topic of focus and set of goals: {goals}"""
+
 
-def generate_question(state: InterviewState, llm):
+def generate_question(state: InterviewState, config):
     """ Node to generate a question """
 
     # Get state
     analyst = state["analyst"]
-    messages = state["messages"]
 
-    # Generate question
-    system_message = question_instructions.format(name=analyst.name, goals=analyst.persona)
-    question = llm.invoke([SystemMessage(content=system_message)] + messages)
+    # Generate question from the recent turns and the summary of the earlier ones
+    persona = question_persona.format(name=analyst.name, goals=analyst.persona)
+    question = chat_model(config, role="question").invoke(recent_history(state, question_instructions, persona))
 
-    # Print the generated question
-    print(f"\n[Analyst Question]: {question.content}")
+    # Print the generated question (streamed token by token instead when streaming is on)
+    if not is_streaming(config):
+        print(f"\n[Analyst Question - {analyst.name}]: {question.content}")
 
     # Write messages to state
     return {"messages": [question]}
 
 
+async def agenerate_question(state: InterviewState, config):
+    """ Node to generate a question (async) """
+
+    analyst = state["analyst"]
+
+    persona = question_persona.format(name=analyst.name, goals=analyst.persona)
+    question = await chat_model(config, role="question").ainvoke(recent_history(state, question_instructions, persona))
+
+    if not is_streaming(config):
+        print(f"\n[Analyst Question - {analyst.name}]: {question.content}")
+
+    return {"messages": [question]}
+
+
 
 
 # Search query writing
@@ -77,61 +114,76 @@ Pay particular attention to the final question posed by the analyst.
 Convert this final question into a well-structured web search query""")
 
 
-def search_web(state: InterviewState, llm):
+def generate_search_query(state: InterviewState, config):
+    """ Node to turn the latest question into one search query shared by all retrievers """
+
+    # Search query
+    structured_llm = chat_model(config, SearchQuery, role="query")
+    search_query = structured_llm.invoke(recent_history(state, search_instructions.content))
+
+    return {"search_query": search_query.search_query}
+
+
+async def agenerate_search_query(state: InterviewState, config):
+    """ Node to generate the shared search query (async) """
+
+    structured_llm = chat_model(config, SearchQuery, role="query")
+    search_query = await structured_llm.ainvoke(recent_history(state, search_instructions.content))
+
+    return {"search_query": search_query.search_query}
+
+
+def search_web(state: InterviewState):
     """ Retrieve docs from web search """
 
-    # Web search tool
-    tavily_search = TavilySearchResults(max_results=3)
+    # Search (served from a matching speculative search or the retrieval cache when possible)
+    search_docs = prefetched_search(state, "web")
+    documents = [web_document(doc) for doc in search_docs]
 
-    # Search query
-    structured_llm = llm.with_structured_output(SearchQuery)
-    search_query = structured_llm.invoke([search_instructions] + state['messages'])
+    # Share them with the other interviews on the topic
+    get_document_store(state.get("topic", "")).add(documents)
+
+    return {"context": documents}
 
-    # Search
-    search_docs = tavily_search.invoke(search_query.search_query)
 
-    # Format
-    formatted_search_docs = "\n\n---\n\n".join(
-        [
-            f'<Document href="{doc["url"]}"/>\n{doc["content"]}\n</Document>'
-            for doc in search_docs
-        ]
-    )
+async def asearch_web(state: InterviewState):
+    """ Retrieve docs from web search (async) """
 
-    return {"context": [formatted_search_docs]}
+    search_docs = await aprefetched_search(state, "web")
+    documents = [web_document(doc) for doc in search_docs]
+    get_document_store(state.get("topic", "")).add(documents)
 
+    return {"context": documents}
 
-def search_wikipedia(state: InterviewState, llm):
+
+def search_wikipedia(state: InterviewState):
     """ Retrieve docs from wikipedia """
 
-    # Search query
-    structured_llm = llm.with_structured_output(SearchQuery)
-    search_query = structured_llm.invoke([search_instructions] + state['messages'])
+    # Search (served from a matching speculative search or the retrieval cache when possible)
+    search_docs = prefetched_search(state, "wikipedia")
+    documents = [wikipedia_document(doc) for doc in search_docs]
 
-    # Search
-    search_docs = WikipediaLoader(query=search_query.search_query,
-                                  load_max_docs=2).load()
+    # Share them with the other interviews on the topic
+    get_document_store(state.get("topic", "")).add(documents)
 
-    # Format
-    formatted_search_docs = "\n\n---\n\n".join(
-        [
-            f'<Document source="{doc.metadata["source"]}" page="{doc.metadata.get("page", "")}"/>\n{doc.page_content}\n</Document>'
-            for doc in search_docs
-        ]
-    )
+    return {"context": documents}
 
-    return {"context": [formatted_search_docs]}
 
+async def asearch_wikipedia(state: InterviewState):
+    """ Retrieve docs from wikipedia (async) """
 
-answer_instructions = """You are an expert being interviewed by an analyst.
+    search_docs = await aprefetched_search(state, "wikipedia")
+    documents = [wikipedia_document(doc) for doc in search_docs]
+    get_document_store(state.get("topic", "")).add(documents)
 
-Here is analyst area of focus: {goals}. 
+    return {"context": documents}
 
-You goal is to answer a question posed by the interviewer.
 
-To answer question, use this context:
+answer_instructions = """You are an expert being interviewed by an analyst.
+
+You goal is to answer a question posed by the interviewer.
 
-{context}
+To answer question, use the context given at the end of the conversation.
 
 When answering questions, follow these guidelines:
 
@@ -139,11 +191,11 @@ When answering questions, follow these guidelines:
 
 2. Do not introduce external information or make assumptions beyond what is explicitly stated in the context.
 
-3. The context contain sources at the topic of each individual document.
+3. The context contain sources at the topic of each individual document, each labelled with its citation number, e.g. [1].
 
-4. Include these sources your answer next to any relevant statements. For example, for source # 1 use [1]. 
+4. Include these sources your answer next to any relevant statements, using the citation number of the document. For example, for document [3] use [3]. 
 
-5. List your sources in order at the bottom of your answer. [1] Source 1, [2] Source 2, etc
+5. List your sources in order at the bottom of your answer using the same numbers. [1] Source 1, [3] Source 3, etc
 
 6. If the source is: <Document source="assistant/docs/llama3_1.pdf" page="7"/>' then just list: 
 
@@ -151,27 +203,65 @@ When answering questions, follow these guidelines:
 
 And skip the addition of the brackets as well as the Document source preamble in your citation."""
 
+answer_persona = """Here is analyst area of focus: {goals}."""
+
+answer_documents = """Context for the latest question:
+
+{context}"""
+
 
-def generate_answer(state: InterviewState, llm):
+def answer_context(state: InterviewState):
+    """ Chunks of the topic's documents most relevant to the current question that fit the context budget.
+    Returns the formatted context and the documents it cites that this interview had not retrieved itself """
+    query = f"{state.get('search_query', '')} {state['messages'][-1].content}"
+    budget = state.get("context_token_budget") or answer_context_tokens
+
+    # Without sharing the prompt depends only on this interview's own documents, so recorded LLM calls replay exactly
+    if not documents_shared():
+        return format_context(select_context(state["context"], query, budget)), []
+
+    store = get_document_store(state.get("topic", ""))
+    # The context of a resumed interview may not be in the store yet
+    store.add(state["context"])
+    documents, new_documents = chunk_context(store, state["context"], query, budget)
+    if not documents:
+        return format_context(select_context(state["context"], query, budget)), []
+    return format_context(documents), new_documents
+
+
+def generate_answer(state: InterviewState, config):
     """ Node to answer a question """
 
     # Get state
     analyst = state["analyst"]
-    messages = state["messages"]
-    context = state["context"]
+    context, shared_documents = answer_context(state)
+
+    # Start searching for the likely follow-up while the expert answers (when prefetching is on)
+    prefetch(state)
 
     # Print the current context to check if it's changing with each question
     #print("\n[Context Update]:", context)
 
-    # Answer question
-    system_message = answer_instructions.format(goals=analyst.persona, context=context)
-    answer = llm.invoke([SystemMessage(content=system_message)] + messages)
+    # Answer question: the documents go last, after the conversation, so the rest of the prompt is a cacheable prefix
+    persona = answer_persona.format(goals=analyst.persona)
+    answer = chat_model(config, role="answer").invoke(recent_history(state, answer_instructions, persona, answer_documents.format(context=context)))
 
     # Name the message as coming from the expert
     answer.name = "expert"
 
-    # Print the answer
-    print(f"\n[Expert Answer]: {answer.content}")
+    # Print the answer (streamed token by token instead when streaming is on)
+    if not is_streaming(config):
+        print(f"\n[Expert Answer - {analyst.name}]: {answer.content}")
+
+    # Measure what this turn added (the documents borrowed from other interviews included), to decide whether another question is worth asking
+    novelty = turn_novelty(state, answer.content, shared_documents)
+
+    # Archive the exchange as soon as it is over
+    archive_turn(state, answer, novelty)
+
+    # Searches for the follow-up suggested by the answer run while the next question is written
+    if not novelty["stop"]:
+        prefetch(state, answer.content)
 
     # Increment the number of responses
     state["num_responses"] += 1
@@ -179,7 +269,38 @@ def generate_answer(state: InterviewState, llm):
     # Return updated state to persist num_responses and append the message
     return {
         "messages": [answer],
-        "num_responses": state["num_responses"]
+        "num_responses": state["num_responses"],
+        "novelty": [novelty],
+        "context": shared_documents
+    }
+
+
+async def agenerate_answer(state: InterviewState, config):
+    """ Node to answer a question (async) """
+
+    analyst = state["analyst"]
+
+    context, shared_documents = answer_context(state)
+    await aprefetch(state)
+
+    persona = answer_persona.format(goals=analyst.persona)
+    answer = await chat_model(config, role="answer").ainvoke(recent_history(state, answer_instructions, persona, answer_documents.format(context=context)))
+
+    answer.name = "expert"
+
+    if not is_streaming(config):
+        print(f"\n[Expert Answer - {analyst.name}]: {answer.content}")
+
+    novelty = turn_novelty(state, answer.content, shared_documents)
+    archive_turn(state, answer, novelty)
+    if not novelty["stop"]:
+        await aprefetch(state, answer.content)
+
+    return {
+        "messages": [answer],
+        "num_responses": state["num_responses"] + 1,
+        "novelty": [novelty],
+        "context": shared_documents
     }
 
 
@@ -192,6 +313,12 @@ def save_interview(state: InterviewState):
     # Convert interview to a string
     interview = get_buffer_string(messages)
 
+    # No more searches: whatever was prefetched for a next turn is not needed
+    release_prefetches(state["interview_id"])
+
+    # Archive the transcript and the documents it cited
+    archive_interview(state)
+
     # Save to interviews key
     return {"sections": [interview]}
 
@@ -220,9 +347,14 @@ def route_messages(state: InterviewState, name: str = "expert"):
         print("-" * 100)
         return 'save_interview'
 
+    if stopped_early(state):
+        print(f"[Route Decision]: Last turn added little new information (gain {state['novelty'][-1]['gain']:.2f}). Saving interview.")
+        print("-" * 100)
+        return 'save_interview'
+
     print("[Route Decision]: Continuing with the next question.")
     print("-" * 100)
-    return "ask_question"
+    return "compact_history"
 
 
 section_writer_instructions = """You are an expert technical writer. 
@@ -241,8 +373,7 @@ a. Title (## header)
 b. Summary (### header)
 c. Sources (### header)
 
-4. Make your title engaging based upon the focus area of the analyst: 
-{focus}
+4. Make your title engaging based upon the focus area of the analyst, given after these instructions.
 
 5. For the summary section:
 - Set up summary with general background / context related to the focus area of the analyst
@@ -276,81 +407,239 @@ There should be no redundant sources. It should simply be:
 - Include no preamble before the title of the report
 - Check that all guidelines have been followed"""
 
+section_writer_focus = """Focus area of the analyst: {focus}"""
+
 
-def write_section(state: InterviewState, llm):
+def write_section(state: InterviewState, config):
     """ Node to answer a question """
 
     # Get state
     interview = state["sections"]
-    context = state["context"]
     analyst = state["analyst"]
+    context = format_context(select_context(state["context"], analyst.description, section_context_tokens))
 
     # Write section using either the gathered source docs from interview (context) or the interview itself (interview)
-    system_message = section_writer_instructions.format(focus=analyst.description)
-    section = llm.invoke([SystemMessage(content=system_message)] + [HumanMessage(content=f"Use this source to write your section: {context}, {interview}")])
+    focus = section_writer_focus.format(focus=analyst.description)
+    section = chat_model(config, role="writing").invoke([SystemMessage(content=section_writer_instructions), SystemMessage(content=focus)] + [HumanMessage(content=f"Use this source to write your section: {context}, {interview}")])
 
     # Append it to state
     return {"sections": [section.content]}  # Adds the final report section
 
 
-# Add nodes and edges
-interview_builder = StateGraph(InterviewState)
-interview_builder.add_node("ask_question", lambda state: generate_question(state, llm))
-interview_builder.add_node("search_web", lambda state: search_web(state, llm))
-interview_builder.add_node("search_wikipedia", lambda state: search_wikipedia(state, llm))
-interview_builder.add_node("answer_question", lambda state: generate_answer(state, llm))
-interview_builder.add_node("save_interview", save_interview)
-interview_builder.add_node("write_section", lambda state: write_section(state, llm))
+async def awrite_section(state: InterviewState, config):
+    """ Node to write the report section (async) """
 
-# Flow
-interview_builder.add_edge(START, "ask_question")
-interview_builder.add_edge("ask_question", "search_web")
-interview_builder.add_edge("ask_question", "search_wikipedia")
-interview_builder.add_edge("search_web", "answer_question")
-interview_builder.add_edge("search_wikipedia", "answer_question")
-interview_builder.add_conditional_edges("answer_question", route_messages, ['ask_question', 'save_interview'])
-interview_builder.add_edge("save_interview", "write_section")
-interview_builder.add_edge("write_section", END)
+    analyst = state["analyst"]
+    context = format_context(select_context(state["context"], analyst.description, section_context_tokens))
+
+    focus = section_writer_focus.format(focus=analyst.description)
+    section = await chat_model(config, role="writing").ainvoke([SystemMessage(content=section_writer_instructions), SystemMessage(content=focus)] + [HumanMessage(content=f"Use this source to write your section: {context}, {state['sections']}")])
+
+    return {"sections": [section.content]}
+
+
+def add_interview_flow(builder: StateGraph):
+    """ Wire the interview nodes together """
+    builder.add_edge(START, "ask_question")
+    builder.add_edge("ask_question", "generate_query")
+    builder.add_edge("generate_query", "search_web")
+    builder.add_edge("generate_query", "search_wikipedia")
+    builder.add_edge("search_web", "answer_question")
+    builder.add_edge("search_wikipedia", "answer_question")
+    builder.add_conditional_edges("answer_question", route_messages, ['compact_history', 'save_interview'])
+    builder.add_edge("compact_history", "ask_question")
+    builder.add_edge("save_interview", "write_section")
+    builder.add_edge("write_section", END)
+
+
+# Checkpointer of the interview graph; the async graph always keeps its checkpoints in memory
+interview_memory = MemorySaver()
+interview_checkpointer = interview_memory
+
+
+@functools.lru_cache(maxsize=None)
+def get_interview_graph(asynchronous: bool = False):
+    """ Build and compile the interview graph on first use (the async one has async nodes, driven by aconduct_interview_with_analyst) """
+    interview_builder = StateGraph(InterviewState)
+    if asynchronous:
+        interview_builder.add_node("ask_question", instrument("interview", "ask_question", agenerate_question))
+        interview_builder.add_node("generate_query", instrument("interview", "generate_query", agenerate_search_query))
+        interview_builder.add_node("search_web", instrument("interview", "search_web", asearch_web))
+        interview_builder.add_node("search_wikipedia", instrument("interview", "search_wikipedia", asearch_wikipedia))
+        interview_builder.add_node("answer_question", instrument("interview", "answer_question", agenerate_answer))
+        interview_builder.add_node("compact_history", instrument("interview", "compact_history", acompact_history))
+        interview_builder.add_node("write_section", instrument("interview", "write_section", awrite_section))
+    else:
+        interview_builder.add_node("ask_question", instrument("interview", "ask_question", generate_question))
+        interview_builder.add_node("generate_query", instrument("interview", "generate_query", generate_search_query))
+        interview_builder.add_node("search_web", instrument("interview", "search_web", search_web))
+        interview_builder.add_node("search_wikipedia", instrument("interview", "search_wikipedia", search_wikipedia))
+        interview_builder.add_node("answer_question", instrument("interview", "answer_question", generate_answer))
+        interview_builder.add_node("compact_history", instrument("interview", "compact_history", compact_history))
+        interview_builder.add_node("write_section", instrument("interview", "write_section", write_section))
+    interview_builder.add_node("save_interview", instrument("interview", "save_interview", save_interview))
+
+    # Flow
+    add_interview_flow(interview_builder)
+
+    if asynchronous:
+        return interview_builder.compile(checkpointer=interview_memory).with_config(run_name="Conduct interviews (async)")
+    return interview_builder.compile(checkpointer=interview_checkpointer).with_config(run_name="Conduct interviews")
+
+
+def set_interview_checkpointer(checkpointer):
+    """ Use another checkpointer for the interview graph, e.g. a durable SQLite one; the graph is rebuilt on next use """
+    global interview_checkpointer
+    interview_checkpointer = checkpointer
+    get_interview_graph.cache_clear()
+
+
+def interview_input(interview_id, analyst, topic, max_questions, run_id=None):
+    """ Initial state for a fresh interview """
+    return {
+        "interview_id": interview_id,
+        "run_id": run_id,
+        "topic": topic,
+        "analyst": analyst,
+        # Initialize a fresh list of messages for each interview
+        "messages": [HumanMessage(f"So you said you were writing an article on {topic}?")],
+        "num_responses": 0,  # Initialize to 0 for each new interview
+        "max_num_questions": max_questions,
+        "context": [],
+        "novelty": [],
+        "summary": "",
+        "summarized": 0,
+        "sections": []
+    }
 
-# Interview
-memory = MemorySaver()
-interview_graph = interview_builder.compile(checkpointer=memory).with_config(run_name="Conduct interviews")
 
+def interview_thread_id(thread_id, analyst):
+    """ Checkpoint thread of an analyst's interview: its own namespace under the run's thread, stable across restarts.
+    The fingerprint keeps a revised persona that kept its name from resuming the interview of the earlier version """
+    return f"{thread_id}:interview:{analyst.name}:{analyst_fingerprint(analyst)}"
 
-def conduct_interview_with_analyst(analyst, topic, max_questions, thread_id, llm_model, llm_temperature):
 
-    interview_id = str(uuid.uuid4())  # Unique ID for each session
+def conduct_interview_with_analyst(analyst, topic, max_questions, thread_id, llm_model, llm_temperature, sinks=None, callbacks=None):
+    """ Run (or resume) one interview and archive its section; returns the section's content hash.
+    With sinks, LLM tokens are streamed to them as they arrive. Extra callbacks are attached to this interview only """
 
-    # Print statement to indicate the start of the interview
-    print(f"\n")
-    print("-" * 100)
-    print(f"Beginning interview. Interview ID: {interview_id}")
+    # Each interview gets its own checkpoint thread so parallel interviews never share state; the nodes take their model from it
+    config = {"configurable": {"thread_id": interview_thread_id(thread_id, analyst), **llm_config(llm_model, llm_temperature)},
+              "callbacks": list(graph_callbacks) + list(callbacks or [])}
+    interview_graph = get_interview_graph()
 
-    # Initialize a fresh list of messages for each interview
-    messages = [HumanMessage(f"So you said you were writing an article on {topic}?")]
-    config = {"configurable": {"thread_id": thread_id, "session_id": interview_id}}
+    # Pick up where a previous run of this interview stopped, if it was checkpointed
+    saved = interview_graph.get_state(config)
 
-    global llm
-    llm = ChatOpenAI(model=llm_model, temperature=llm_temperature)
+    def run(graph_input, interview_id):
+        if sinks:
+            return stream_graph(interview_graph, graph_input, config, sinks, interview_id, analyst)
+        return interview_graph.invoke(graph_input, config)
 
-    # Start the interview with a fresh state keyed by session_id
-    report = interview_graph.invoke({
-        "interview_id": interview_id,
-        "analyst": analyst,
-        "messages": messages,
-        "num_responses": 0,  # Initialize to 0 for each new interview
-        "max_num_questions": max_questions,
-        "context": [],
-        "sections": []
-    }, config)
+    if saved.next:
+        print(f"\nResuming interview with {analyst.name}. Interview ID: {saved.values['interview_id']}")
+        report = run(None, saved.values['interview_id'])
+    elif saved.values.get("sections"):
+        print(f"\nInterview with {analyst.name} already finished. Interview ID: {saved.values['interview_id']}")
+        report = saved.values
+    else:
+        interview_id = str(uuid.uuid4())  # Unique ID for each session
+
+        # Print statement to indicate the start of the interview
+        print()
+        print("-" * 100)
+        print(f"Beginning interview. Interview ID: {interview_id}")
+
+        # Start the interview with a fresh state
+        report = run(interview_input(interview_id, analyst, topic, max_questions, thread_id), interview_id)
+
+    # Archive the section for the final report, which is rebuilt where it changed
+    section_hash = save_section(analyst, report['sections'][0], thread_id)
+
+    # The section is archived, so the interview's checkpoints can be pruned
+    release_thread(interview_graph, config, as_node="write_section")
+
+    return section_hash
+
+
+async def aconduct_interview_with_analyst(analyst, topic, max_questions, thread_id, llm_model, llm_temperature, sinks=None, callbacks=None):
+    """ Async version of conduct_interview_with_analyst """
+
+    config = {"configurable": {"thread_id": interview_thread_id(thread_id, analyst), **llm_config(llm_model, llm_temperature)},
+              "callbacks": list(graph_callbacks) + list(callbacks or [])}
+    ainterview_graph = get_interview_graph(asynchronous=True)
+
+    saved = await ainterview_graph.aget_state(config)
+
+    async def run(graph_input, interview_id):
+        if sinks:
+            return await astream_graph(ainterview_graph, graph_input, config, sinks, interview_id, analyst)
+        return await ainterview_graph.ainvoke(graph_input, config)
+
+    if saved.next:
+        print(f"\nResuming interview with {analyst.name}. Interview ID: {saved.values['interview_id']}")
+        report = await run(None, saved.values['interview_id'])
+    elif saved.values.get("sections"):
+        report = saved.values
+    else:
+        interview_id = str(uuid.uuid4())
+
+        print()
+        print("-" * 100)
+        print(f"Beginning interview. Interview ID: {interview_id}")
+
+        report = await run(interview_input(interview_id, analyst, topic, max_questions, thread_id), interview_id)
+
+    section_hash = save_section(analyst, report['sections'][0], thread_id)
+
+    await arelease_thread(ainterview_graph, config, as_node="write_section")
+
+    return section_hash
+
+
+def conduct_interviews(analysts, topic, max_questions, thread_id, llm_model, llm_temperature, max_concurrency=4, sinks=None):
+    """ Run the interviews for all analysts in parallel, at most max_concurrency at a time """
+
+    reports = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {
+            executor.submit(conduct_interview_with_analyst, analyst, topic, max_questions, thread_id, llm_model, llm_temperature, sinks): analyst
+            for analyst in analysts
+        }
+
+        for future in as_completed(futures):
+            analyst = futures[future]
+            try:
+                reports[analyst.name] = future.result()
+            except Exception as e:
+                # A failed interview should not take down the other interviews
+                print(f"Interview with {analyst.name} failed: {e!r}")
+
+    # Every interview on the topic is done, so their shared documents can go
+    release_document_store(topic)
+
+    return reports
+
+
+async def aconduct_interviews(analysts, topic, max_questions, thread_id, llm_model, llm_temperature, max_concurrency=4, sinks=None):
+    """ Run the interviews for all analysts on one event loop, at most max_concurrency at a time """
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(analyst):
+        async with semaphore:
+            return await aconduct_interview_with_analyst(analyst, topic, max_questions, thread_id, llm_model, llm_temperature, sinks)
 
-    # Convert report to Markdown text
-    markdown_content = markdown.markdown(report['sections'][0])
+    results = await asyncio.gather(*(run(analyst) for analyst in analysts), return_exceptions=True)
 
-    # Save to Markdown file
-    filename = f"interview_report_{analyst.name}.md"
+    reports = {}
+    for analyst, result in zip(analysts, results):
+        if isinstance(result, Exception):
+            print(f"Interview with {analyst.name} failed: {result!r}")
+        else:
+            reports[analyst.name] = result
 
-    with open(filename, "w", encoding="utf-8") as file:
-        file.write(markdown_content)
+    release_document_store(topic)
 
-    print(f"Report saved as '{filename}'")
+    return reports
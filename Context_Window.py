@@ -0,0 +1,109 @@
+import math
+import re
+import hashlib
+
+# Deduplicated, token-bounded context for the expert and the section writer
+
+# Default token budgets for the documents sent with a prompt
+answer_context_tokens = 4000
+section_context_tokens = 8000
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "has", "her", "was", "one", "our",
+    "out", "his", "how", "its", "who", "did", "get", "may", "what", "when", "which", "with", "this", "that", "from",
+    "they", "will", "would", "there", "their", "about", "into", "than", "then", "them", "these", "have", "your",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """ Rough token count (about four characters per token) """
+    return len(text) // 4 + 1
+
+
+def terms(text: str) -> list:
+    """ Lowercase content words of a text """
+    return [word for word in _WORD.findall(text.lower()) if len(word) > 2 and word not in _STOPWORDS]
+
+
+def web_document(doc: dict) -> dict:
+    """ Context document for a web search result """
+    return {"type": "web", "source": doc["url"], "page": "", "content": doc["content"]}
+
+
+def wikipedia_document(doc: dict) -> dict:
+    """ Context document for a Wikipedia page """
+    return {"type": "wikipedia", "source": doc["source"], "page": doc.get("page", ""), "content": doc["content"]}
+
+
+def document_key(doc: dict) -> str:
+    """ Identity of a document: its URL / source and page, or its content hash when it has no source """
+    if doc.get("source"):
+        return f"{doc['source']}#{doc.get('page', '')}"
+    return hashlib.sha256(doc["content"].encode("utf-8")).hexdigest()
+
+
+def merge_documents(existing: list, new: list) -> list:
+    """ Reducer for InterviewState.context: keep one copy of each document and give it a stable citation number """
+    merged = list(existing or [])
+    seen = {document_key(doc) for doc in merged}
+
+    for doc in new or []:
+        key = document_key(doc)
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append({**doc, "citation": len(merged) + 1})
+
+    return merged
+
+
+def rank_documents(documents: list, query: str) -> list:
+    """ Order documents by term overlap with the query (idf weighted), newest first on ties """
+    query_terms = set(terms(query))
+    doc_terms = [set(terms(doc["content"])) for doc in documents]
+
+    def idf(term):
+        df = sum(1 for words in doc_terms if term in words)
+        return math.log(1 + len(documents) / (1 + df))
+
+    weights = {term: idf(term) for term in query_terms}
+    scored = [
+        (math.fsum(weights[term] for term in query_terms & words), doc["citation"], doc)
+        for doc, words in zip(documents, doc_terms)
+    ]
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [doc for _, _, doc in scored]
+
+
+def select_context(documents: list, query: str, token_budget: int) -> list:
+    """ Most relevant documents that fit in the token budget, in citation order """
+    selected = []
+    used = 0
+
+    for doc in rank_documents(documents, query):
+        tokens = estimate_tokens(doc["content"])
+        if used + tokens > token_budget:
+            if selected:
+                continue
+            # Always keep the best document, trimmed to the budget
+            doc = {**doc, "content": doc["content"][:token_budget * 4]}
+            tokens = token_budget
+        selected.append(doc)
+        used += tokens
+
+    return sorted(selected, key=lambda doc: doc["citation"])
+
+
+def format_document(doc: dict) -> str:
+    """ Format one document with its citation number """
+    if doc["type"] == "web":
+        header = f'<Document href="{doc["source"]}"/>'
+    else:
+        header = f'<Document source="{doc["source"]}" page="{doc["page"]}"/>'
+    return f'[{doc["citation"]}] {header}\n{doc["content"]}\n</Document>'
+
+
+def format_context(documents: list) -> str:
+    """ Format documents as prompt context """
+    return "\n\n---\n\n".join(format_document(doc) for doc in documents)
@@ -0,0 +1,191 @@
+import math
+import threading
+from collections import Counter
+from Context_Window import terms, estimate_tokens, document_key
+
+# Topic-scoped store of every document retrieved by the interviews of a run
+#
+# Each document is kept once (by URL / source and page, or content hash), split into overlapping chunks and indexed.
+# The expert answers from the top chunks for the question, whichever interview retrieved them, instead of whole documents.
+# The index is BM25 (offline, no dependencies) or, when an embeddings model is configured, NumPy cosine similarity.
+
+chunk_words = 180  # Words per chunk (about 240 tokens)
+chunk_overlap = 30  # Words shared by consecutive chunks
+answer_top_k = 8  # Chunks sent with each answer, within the answer context budget
+embeddings = None  # LangChain Embeddings (embed_documents / embed_query); None means BM25
+share_documents = True  # Answer from documents other interviews found; off when LLM calls are recorded or replayed (which interview finds a document first is timing-dependent)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def chunk_text(text: str, words_per_chunk: int = None, overlap: int = None) -> list:
+    """ Split a text into overlapping windows of words """
+    words_per_chunk = words_per_chunk or chunk_words
+    overlap = chunk_overlap if overlap is None else overlap
+    words = text.split()
+    if len(words) <= words_per_chunk:
+        return [text] if words else []
+    step = max(1, words_per_chunk - overlap)
+    return [" ".join(words[start:start + words_per_chunk]) for start in range(0, len(words) - overlap, step)]
+
+
+class DocumentStore:
+    """ One copy of each document of a topic, chunked and indexed for retrieval """
+
+    def __init__(self, topic: str, embeddings=None):
+        self.topic = topic
+        self.embeddings = embeddings
+        self._lock = threading.Lock()
+        self.documents = {}  # key -> document (without citation)
+        self.chunks = []  # {"key", "index", "content", "tokens"}
+        self._terms = []  # Term counts of each chunk
+        self._document_frequency = Counter()
+        self._total_length = 0
+        self._vectors = None  # NumPy matrix of normalized chunk embeddings
+
+    def add(self, documents: list) -> int:
+        """ Add documents not seen yet, returning how many were new """
+        new = []
+        with self._lock:
+            for doc in documents or []:
+                key = document_key(doc)
+                if key in self.documents:
+                    continue
+                self.documents[key] = {name: value for name, value in doc.items() if name != "citation"}
+                for index, content in enumerate(chunk_text(doc["content"])):
+                    new.append({"key": key, "index": index, "content": content, "tokens": estimate_tokens(content)})
+        if not new:
+            return 0
+
+        # Embed outside the lock (it is slow), then index the chunks and their vectors together so they stay aligned
+        try:
+            vectors = self._embed(new) if self.embeddings is not None else None
+        except Exception:
+            with self._lock:
+                for key in {chunk["key"] for chunk in new}:
+                    self.documents.pop(key, None)
+            raise
+
+        with self._lock:
+            for chunk in new:
+                counts = Counter(terms(chunk["content"]))
+                self.chunks.append(chunk)
+                self._terms.append(counts)
+                self._document_frequency.update(counts.keys())
+                self._total_length += sum(counts.values())
+            if vectors is not None:
+                import numpy as np
+                self._vectors = vectors if self._vectors is None else np.vstack([self._vectors, vectors])
+        return len({chunk["key"] for chunk in new})
+
+    def _embed(self, chunks: list):
+        """ Normalized embeddings of the chunks, one row each """
+        import numpy as np
+        vectors = np.array(self.embeddings.embed_documents([chunk["content"] for chunk in chunks]), dtype=float)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        return vectors
+
+    def _bm25_scores(self, query: str) -> list:
+        # Sorted so the float sums (and ties between chunks) do not depend on the process's string hash seed
+        query_terms = sorted(set(terms(query)))
+        count = len(self.chunks)
+        average_length = self._total_length / max(count, 1)
+        idf = {term: math.log(1 + (count - self._document_frequency[term] + 0.5) / (self._document_frequency[term] + 0.5)) for term in query_terms}
+        scores = []
+        for counts in self._terms:
+            length = sum(counts.values())
+            score = 0.0
+            for term in query_terms:
+                frequency = counts.get(term, 0)
+                if frequency:
+                    score += idf[term] * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+            scores.append(score)
+        return scores
+
+    def _cosine_scores(self, query: str) -> list:
+        import numpy as np
+        vector = np.array(self.embeddings.embed_query(query), dtype=float)
+        vector /= np.linalg.norm(vector) + 1e-12
+        with self._lock:
+            vectors = self._vectors
+        return list(vectors @ vector) if vectors is not None else []
+
+    def search(self, query: str, k: int = None, token_budget: int = None) -> list:
+        """ Best matching chunks for a query: at most k of them and, with a budget, no more tokens than it allows """
+        k = k or answer_top_k
+        if self.embeddings is not None:
+            scores = self._cosine_scores(query)
+        else:
+            with self._lock:
+                scores = self._bm25_scores(query)
+        with self._lock:
+            ranked = sorted(zip(scores, range(len(scores))), key=lambda item: item[0], reverse=True)
+            chunks = [self.chunks[index] for score, index in ranked if score > 0]
+
+        selected, used = [], 0
+        for chunk in chunks:
+            if len(selected) == k:
+                break
+            if token_budget and used + chunk["tokens"] > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk["tokens"]
+        return selected
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"documents": len(self.documents), "chunks": len(self.chunks),
+                    "tokens": sum(chunk["tokens"] for chunk in self.chunks)}
+
+
+document_stores = {}
+_stores_lock = threading.Lock()
+
+
+def configure_document_sharing(enabled: bool = True):
+    """ Let interviews answer from the topic's shared store, or only from the documents they retrieved themselves """
+    global share_documents
+    share_documents = enabled
+
+
+def documents_shared() -> bool:
+    return share_documents
+
+
+def get_document_store(topic: str) -> DocumentStore:
+    """ Store shared by every interview on a topic, created on first use """
+    with _stores_lock:
+        if topic not in document_stores:
+            document_stores[topic] = DocumentStore(topic, embeddings)
+        return document_stores[topic]
+
+
+def release_document_store(topic: str):
+    """ Drop a topic's store once all of its interviews are done """
+    with _stores_lock:
+        document_stores.pop(topic, None)
+
+
+def chunk_context(store: DocumentStore, context: list, query: str, token_budget: int):
+    """ Top chunks for a query as citable documents: chunks of the same document are joined under its citation number.
+    Returns (documents to format, documents new to this interview's context) """
+    cited = {document_key(doc): doc for doc in context}
+    next_citation = len(context) + 1
+    grouped, new_documents = {}, []
+
+    for chunk in store.search(query, token_budget=token_budget):
+        key = chunk["key"]
+        if key not in cited:
+            # Found by another interview on the topic: cite it here too
+            doc = {**store.documents[key], "citation": next_citation}
+            cited[key] = doc
+            new_documents.append(doc)
+            next_citation += 1
+        grouped.setdefault(key, []).append(chunk)
+
+    documents = [
+        {**cited[key], "content": "\n...\n".join(chunk["content"] for chunk in sorted(chunks, key=lambda chunk: chunk["index"]))}
+        for key, chunks in grouped.items()
+    ]
+    return sorted(documents, key=lambda doc: doc["citation"]), new_documents
@@ -0,0 +1,61 @@
+from Context_Window import terms
+from Instrumentation import current_usage
+
+# Adaptive interview depth: stop asking questions once new turns stop adding information
+#
+# After every answer the interview records how many new documents the turn's searches added to the context and how
+# much of the answer repeats earlier answers. Their blend is the turn's information gain:
+#   gain = (1 - answer_weight) * min(1, new_documents / expected_new_documents) + answer_weight * (1 - answer_overlap)
+# Once the gain falls below the threshold the interview is saved, even if max_num_questions is not reached yet.
+
+early_exit_threshold = 0.25  # 0 turns early exit off
+expected_new_documents = 3  # New documents a fully informative turn adds (web + wikipedia)
+answer_weight = 0.5  # Share of the gain that comes from the answer's novelty rather than the documents'
+min_questions = 2  # Answers before an interview may stop early
+
+# What one skipped turn would have cost: ask_question, generate_query and answer_question, plus both searches
+LLM_CALLS_PER_TURN = 3
+SEARCHES_PER_TURN = 2
+
+
+def answer_overlap(answer: str, earlier_answers: list) -> float:
+    """ Share of the answer's distinct content words already used in earlier answers """
+    words = set(terms(answer))
+    if not words or not earlier_answers:
+        return 0.0
+    earlier = set()
+    for text in earlier_answers:
+        earlier.update(terms(text))
+    return len(words & earlier) / len(words)
+
+
+def turn_novelty(state: dict, answer: str, shared_documents: list = None) -> dict:
+    """ Information gain of the turn that produced `answer`, and whether the interview should stop after it.
+    shared_documents are the documents of other interviews this turn's answer cited, which join the context with it """
+    history = state.get("novelty") or []
+    documents = len(state.get("context") or []) + len(shared_documents or [])
+    new_documents = documents - (history[-1]["documents"] if history else 0)
+    earlier_answers = [message.content for message in state["messages"] if getattr(message, "name", None) == "expert"]
+    overlap = answer_overlap(answer, earlier_answers)
+    gain = (1 - answer_weight) * min(1.0, new_documents / expected_new_documents) + answer_weight * (1 - overlap)
+
+    turn = state["num_responses"] + 1
+    threshold = state.get("early_exit_threshold")
+    threshold = early_exit_threshold if threshold is None else threshold
+    remaining = state["max_num_questions"] - turn
+    stop = remaining > 0 and turn >= min_questions and gain < threshold
+
+    if stop:
+        # Report what the skipped turns would have cost with the answer node's metrics event
+        usage = current_usage()
+        if usage is not None:
+            usage.note(early_exit=1, skipped_turns=remaining, saved_llm_calls=remaining * LLM_CALLS_PER_TURN,
+                       saved_searches=remaining * SEARCHES_PER_TURN)
+
+    return {"turn": turn, "documents": documents, "new_documents": new_documents, "answer_overlap": overlap, "gain": gain, "stop": stop}
+
+
+def stopped_early(state: dict) -> bool:
+    """ True when the last turn's information gain was below the threshold """
+    history = state.get("novelty") or []
+    return bool(history) and history[-1]["stop"]
@@ -1,15 +1,30 @@
+import hashlib
 import json
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+import asyncio
+import functools
 from typing import List
 from typing_extensions import TypedDict
 from pydantic import BaseModel, Field
 from langgraph.graph import START, END, StateGraph
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from Checkpoints import release_thread, arelease_thread
+from Instrumentation import instrument
+from LLM_Clients import llm_config, chat_model
+from Run_Archive import get_run_archive
+
+# Callback handlers attached to every run of the analyst and interview graphs (e.g. for benchmarks)
+graph_callbacks = []
+
+
+def add_graph_callback(handler):
+    graph_callbacks.append(handler)
+
+
+def remove_graph_callback(handler):
+    if handler in graph_callbacks:
+        graph_callbacks.remove(handler)
 
-# Load environment variables from the .env file
-load_dotenv()
 
 # Create analysts and review them using human-in-the-loop
 class Analyst(BaseModel):
@@ -31,6 +46,11 @@ class Analyst(BaseModel):
         return f"Name: {self.name}\nRole: {self.role}\nAffiliation: {self.affiliation}\nDescription: {self.description}\n"
 
 
+def analyst_fingerprint(analyst: Analyst) -> str:
+    """ Short hash of every field of an analyst: a revised persona gets a new fingerprint even if its name is kept """
+    return hashlib.sha256(json.dumps(analyst.dict(), sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
 # Create structured output for LLM
 class Perspectives(BaseModel):
     analysts: List[Analyst] = Field(
@@ -42,6 +62,7 @@ class GenerateAnalystsState(TypedDict):
     topic: str  # Research topic
     max_analysts: int  # Number of analysts
     human_analyst_feedback: str  # Human feedback
+    target_analyst: str  # Name of the only analyst the feedback is about, if any
     analysts: List[Analyst]  # Analyst asking questions
 
 
@@ -56,7 +77,7 @@ create_analyst_instructions = """You are tasked with creating a set of AI analys
 4. Assign one analyst to each theme."""
 
 
-def create_analysts(state: GenerateAnalystsState, structured_llm):
+def create_analysts(state: GenerateAnalystsState, config):
     """ Create analysts """
 
     topic = state['topic']
@@ -68,13 +89,28 @@ def create_analysts(state: GenerateAnalystsState, structured_llm):
         max_analysts=max_analysts
     )
 
-    # Generate analysts
+    # Generate analysts, with the model chosen in the run's config
+    structured_llm = chat_model(config, Perspectives, role="analysts")
     response = structured_llm.invoke([SystemMessage(content=system_message), HumanMessage(content="Generate the set of analysts.")])
 
     # Write the list of analysis to state
     return {"analysts": response.analysts}
 
 
+async def acreate_analysts(state: GenerateAnalystsState, config):
+    """ Create analysts (async) """
+
+    system_message = create_analyst_instructions.format(
+        topic=state['topic'],
+        max_analysts=state['max_analysts']
+    )
+
+    structured_llm = chat_model(config, Perspectives, role="analysts")
+    response = await structured_llm.ainvoke([SystemMessage(content=system_message), HumanMessage(content="Generate the set of analysts.")])
+
+    return {"analysts": response.analysts}
+
+
 review_analyst_instructions = """You are tasked with reviewing a set of AI analyst personas that you have previously created. 
 
 Follow these instructions carefully:
@@ -87,27 +123,85 @@ Follow these instructions carefully:
 
 3. Update the list of analysts according to the feedback provided, making sure to keep the maximum number of analysts to {max_analysts}.
 
+4. Keep every analyst the feedback does not concern exactly as it is, word for word.
+
 """
 
+revise_analyst_instructions = """You are tasked with revising one AI analyst persona that you have previously created.
 
-def review_analysts(state: GenerateAnalystsState, structured_llm):
-    """ Review analysts """
-    analysts_to_review = "\n".join(analyst.persona for analyst in state.get('analysts', []))
-    max_analysts = state['max_analysts']
-    human_analyst_feedback = state.get('human_analyst_feedback', '')
+1. Here is the analyst to revise:
+{analyst}
 
-    # System message
-    system_message = review_analyst_instructions.format(
-        analysts_to_review=analysts_to_review,
-        human_analyst_feedback=human_analyst_feedback,
-        max_analysts=max_analysts
+2. Here are the other analysts, which stay as they are. Keep the revised analyst distinct from them:
+{other_analysts}
+
+3. Examine the feedback that has been provided about this analyst:
+{human_analyst_feedback}
+
+4. Return the revised analyst, changing only what the feedback asks for.
+
+"""
+
+
+def find_analyst(analysts: List[Analyst], name: str):
+    """ Index of the analyst with this name (case-insensitive), or None """
+    for index, analyst in enumerate(analysts):
+        if analyst.name.strip().lower() == (name or "").strip().lower():
+            return index
+    return None
+
+
+def revision_prompt(state: GenerateAnalystsState):
+    """ Prompt and schema for the review: one analyst when the feedback targets one that exists, else the whole list """
+    analysts = state.get('analysts', [])
+    index = find_analyst(analysts, state.get('target_analyst'))
+    if index is None:
+        system_message = review_analyst_instructions.format(
+            analysts_to_review="\n".join(analyst.persona for analyst in analysts),
+            human_analyst_feedback=state.get('human_analyst_feedback', ''),
+            max_analysts=state['max_analysts']
+        )
+        return system_message, Perspectives, None
+
+    system_message = revise_analyst_instructions.format(
+        analyst=analysts[index].persona,
+        other_analysts="\n".join(analyst.persona for i, analyst in enumerate(analysts) if i != index) or "(none)",
+        human_analyst_feedback=state.get('human_analyst_feedback', '')
     )
+    return system_message, Analyst, index
+
+
+def revised_analysts(state: GenerateAnalystsState, response, index) -> List[Analyst]:
+    """ New list of analysts: the reviewed list, or the old one with only the targeted analyst replaced """
+    if index is None:
+        return response.analysts
+    analysts = list(state['analysts'])
+    analysts[index] = response
+    return analysts
+
 
-    # Generate analysts
+def review_analysts(state: GenerateAnalystsState, config):
+    """ Review analysts: only the targeted one when the feedback names an analyst, else the whole list """
+
+    # System message
+    system_message, schema, index = revision_prompt(state)
+
+    # Generate analysts, with the model chosen in the run's config
+    structured_llm = chat_model(config, schema, role="review")
     response = structured_llm.invoke([SystemMessage(content=system_message), HumanMessage(content="Review the list of analysts.")])
 
     # Write the list of analysis to state
-    return {"analysts": response.analysts}
+    return {"analysts": revised_analysts(state, response, index)}
+
+
+async def areview_analysts(state: GenerateAnalystsState, config):
+    """ Review analysts (async) """
+    system_message, schema, index = revision_prompt(state)
+
+    structured_llm = chat_model(config, schema, role="review")
+    response = await structured_llm.ainvoke([SystemMessage(content=system_message), HumanMessage(content="Review the list of analysts.")])
+
+    return {"analysts": revised_analysts(state, response, index)}
 
 
 def human_feedback(state: GenerateAnalystsState):
@@ -125,63 +219,119 @@ def should_continue(state: GenerateAnalystsState):
     return END
 
 
-# Build the state graph with nodes and edges
-builder = StateGraph(GenerateAnalystsState)
-
-builder.add_node("create_analysts", lambda state: create_analysts(state, structured_llm))
-builder.add_node("review_analysts", lambda state: review_analysts(state, structured_llm))
-builder.add_node("human_feedback", human_feedback)
+def add_analysts_flow(builder: StateGraph):
+    """ Define linear flow from start to create analysts, then to human feedback """
+    builder.add_edge(START, "create_analysts")
+    builder.add_edge("create_analysts", "human_feedback")
+    builder.add_conditional_edges("human_feedback", should_continue, ["review_analysts", END])
+    builder.add_edge("review_analysts", "human_feedback")
 
-# Define linear flow from start to create analysts, then to human feedback
-builder.add_edge(START, "create_analysts")
-builder.add_edge("create_analysts", "human_feedback")
-builder.add_conditional_edges("human_feedback", should_continue, ["review_analysts", END])
-builder.add_edge("review_analysts", "human_feedback")
 
+# Checkpointer of the analyst graph; the async graph always keeps its checkpoints in memory
 memory = MemorySaver()
-graph = builder.compile(interrupt_before=['human_feedback'], checkpointer=memory).with_config(run_name="Generate analysts")
+analysts_checkpointer = memory
+
+
+@functools.lru_cache(maxsize=None)
+def get_analysts_graph(asynchronous: bool = False):
+    """ Build and compile the analyst graph on first use (the async one has async nodes, driven by arun_graph) """
+    builder = StateGraph(GenerateAnalystsState)
+    if asynchronous:
+        builder.add_node("create_analysts", instrument("analysts", "create_analysts", acreate_analysts))
+        builder.add_node("review_analysts", instrument("analysts", "review_analysts", areview_analysts))
+    else:
+        builder.add_node("create_analysts", instrument("analysts", "create_analysts", create_analysts))
+        builder.add_node("review_analysts", instrument("analysts", "review_analysts", review_analysts))
+    builder.add_node("human_feedback", instrument("analysts", "human_feedback", human_feedback))
+    add_analysts_flow(builder)
+
+    if asynchronous:
+        return builder.compile(interrupt_before=['human_feedback'], checkpointer=memory).with_config(run_name="Generate analysts (async)")
+    return builder.compile(interrupt_before=['human_feedback'], checkpointer=analysts_checkpointer).with_config(run_name="Generate analysts")
 
 
+def set_analysts_checkpointer(checkpointer):
+    """ Use another checkpointer for the analyst graph, e.g. a durable SQLite one; the graph is rebuilt on next use """
+    global analysts_checkpointer
+    analysts_checkpointer = checkpointer
+    get_analysts_graph.cache_clear()
+
+
+def print_analysts(title: str, analysts: List[Analyst]):
+    """ Print a list of analysts under a title """
+    print(f"\n>>>>>>>> {title}")
+    for analyst in analysts:
+        print(f"Name: {analyst.name}")
+        print(f"Affiliation: {analyst.affiliation}")
+        print(f"Role: {analyst.role}")
+        print(f"Description: {analyst.description}")
+        print("-" * 50)
+
+
+def save_analysts(analysts: List[Analyst], thr: str):
+    """ Save the final list of analysts to the run archive for replicability """
+    get_run_archive().append(thr, "analysts", [analyst.dict() for analyst in analysts])
+
+    print(f"Analysts data saved to the run archive (run {thr})")
+
+
+def load_analysts(thr: str):
+    """ Load the analysts saved by a previous run, or None when the run has none """
+    analysts_data = get_run_archive().latest(thr, "analysts")
+    return [Analyst(**analyst) for analyst in analysts_data] if analysts_data is not None else None
+
+
+def feedback_prompt(feedback_count: int, max_feedback_loops: int) -> str:
+    return f"Please provide feedback for the analysts, or '@Name: feedback' for one of them (press Enter to end) [{feedback_count + 1}/{max_feedback_loops}]: "
+
+
+def parse_feedback(feedback) -> tuple:
+    """ (target analyst, feedback text) of one round of feedback: "@Name: text", {"analyst": ..., "feedback": ...} or plain text """
+    if isinstance(feedback, dict):
+        return feedback.get("analyst") or None, (feedback.get("feedback") or "").strip()
+    text = (feedback or "").strip()
+    if text.startswith("@") and ":" in text:
+        name, text = text[1:].split(":", 1)
+        return name.strip() or None, text.strip()
+    return None, text
 
 
 # Run the graph
-def run_graph(topic: str, max_analysts: int, llm_model: str, llm_temperature: float, thr: str):
+def run_graph(topic: str, max_analysts: int, llm_model: str, llm_temperature: float, thr: str, feedback: List[str] = None):
+    """ Generate the analysts. Feedback is read from the console, or taken from the feedback list when one is given
+    (an empty list accepts the first draft) """
 
-    global structured_llm
-    # Initialize the language model with parameters provided by main.py
-    llm = ChatOpenAI(model=llm_model, temperature=llm_temperature)
-    # Enforce structured output
-    structured_llm = llm.with_structured_output(Perspectives)
+    graph = get_analysts_graph()
+    get_run_archive().start_run(thr, topic, llm_model=llm_model, llm_temperature=llm_temperature)
 
-    # Common thread ID
-    thread = {"configurable": {"thread_id": thr}}
+    # Common thread ID; the nodes take the model provided by main.py from it
+    thread = {"configurable": {"thread_id": thr, **llm_config(llm_model, llm_temperature)}, "callbacks": list(graph_callbacks)}
 
     # Run the graph to generate the first draft
     for event in graph.stream({"topic": topic, "max_analysts": max_analysts, "human_analyst_feedback": ""}, thread, stream_mode="values"):
         analysts = event.get('analysts', '')
         if analysts:
-            print(f"\n>>>>>>>> FIRST DRAFT")
-            for analyst in analysts:
-                print(f"Name: {analyst.name}")
-                print(f"Affiliation: {analyst.affiliation}")
-                print(f"Role: {analyst.role}")
-                print(f"Description: {analyst.description}")
-                print("-" * 50)
+            print_analysts("FIRST DRAFT", analysts)
 
     # Enter feedback loop with a maximum number of iterations
     max_feedback_loops = 10
     feedback_count = 0
+    feedback_answers = iter(feedback) if feedback is not None else None
 
     while feedback_count < max_feedback_loops:
-        # Ask for human feedback
-        human_feedback = input(f"Please provide feedback for the analysts (press Enter to end) [{feedback_count + 1}/{max_feedback_loops}]: ")
+        # Ask for human feedback, or take the next prepared answer
+        if feedback_answers is None:
+            human_feedback = input(feedback_prompt(feedback_count, max_feedback_loops))
+        else:
+            human_feedback = next(feedback_answers, "")
 
+        target_analyst, human_feedback = parse_feedback(human_feedback)
         if not human_feedback:
             # If no feedback is provided, end the process
             break
 
-        # If feedback is provided, update the state and revise
-        graph.update_state(thread, {"human_analyst_feedback": human_feedback}, as_node="human_feedback")
+        # If feedback is provided, update the state and revise (only the named analyst, when there is one)
+        graph.update_state(thread, {"human_analyst_feedback": human_feedback, "target_analyst": target_analyst}, as_node="human_feedback")
 
         # Run the graph execution with the updated feedback
         events = list(graph.stream(None, thread, stream_mode="values"))
@@ -189,13 +339,7 @@ def run_graph(topic: str, max_analysts: int, llm_model: str, llm_temperature: fl
         if last_event:
             analysts = last_event.get('analysts', '')
             if analysts:
-                print(f"\n>>>>>>>> REVISED DRAFT WITH HUMAN FEEDBACK")
-                for analyst in analysts:
-                    print(f"Name: {analyst.name}")
-                    print(f"Affiliation: {analyst.affiliation}")
-                    print(f"Role: {analyst.role}")
-                    print(f"Description: {analyst.description}")
-                    print("-" * 50)
+                print_analysts("REVISED DRAFT WITH HUMAN FEEDBACK", analysts)
 
         # Increment feedback count
         feedback_count += 1
@@ -204,22 +348,62 @@ def run_graph(topic: str, max_analysts: int, llm_model: str, llm_temperature: fl
     final_state = graph.get_state(thread)
     analysts = final_state.values.get('analysts')
 
-    print("\n>>>>>>>> FINAL LIST")
-    for analyst in analysts:
-        print(f"Name: {analyst.name}")
-        print(f"Affiliation: {analyst.affiliation}")
-        print(f"Role: {analyst.role}")
-        print(f"Description: {analyst.description}")
-        print("-" * 50)
+    print_analysts("FINAL LIST", analysts)
+
+    # Save the final list of analysts to the run archive
+    save_analysts(analysts, thr)
+
+    # The analysts are saved to file, so the review history is no longer needed
+    release_thread(graph, thread)
+
+    return analysts
+
 
-    # Save the final list of analysts to a JSON file
-    analysts_data = [analyst.dict() for analyst in analysts]
-    filename = f"Analysts_{thr}.json"
+async def arun_graph(topic: str, max_analysts: int, llm_model: str, llm_temperature: float, thr: str, feedback: List[str] = None):
+    """ Async version of run_graph: same feedback loop, driven from an event loop """
 
-    # Write to a JSON file
-    with open(filename, "w") as json_file:
-        json.dump(analysts_data, json_file, indent=4)
+    agraph = get_analysts_graph(asynchronous=True)
+    get_run_archive().start_run(thr, topic, llm_model=llm_model, llm_temperature=llm_temperature)
+
+    thread = {"configurable": {"thread_id": thr, **llm_config(llm_model, llm_temperature)}, "callbacks": list(graph_callbacks)}
+
+    # Run the graph to generate the first draft
+    async for event in agraph.astream({"topic": topic, "max_analysts": max_analysts, "human_analyst_feedback": ""}, thread, stream_mode="values"):
+        analysts = event.get('analysts', '')
+        if analysts:
+            print_analysts("FIRST DRAFT", analysts)
+
+    max_feedback_loops = 10
+    feedback_count = 0
+    feedback_answers = iter(feedback) if feedback is not None else None
+
+    while feedback_count < max_feedback_loops:
+        if feedback_answers is None:
+            # Read the feedback off the event loop so other coroutines keep running
+            human_feedback = await asyncio.to_thread(input, feedback_prompt(feedback_count, max_feedback_loops))
+        else:
+            human_feedback = next(feedback_answers, "")
+
+        target_analyst, human_feedback = parse_feedback(human_feedback)
+        if not human_feedback:
+            break
+
+        await agraph.aupdate_state(thread, {"human_analyst_feedback": human_feedback, "target_analyst": target_analyst}, as_node="human_feedback")
+
+        events = [event async for event in agraph.astream(None, thread, stream_mode="values")]
+        last_event = events[-1] if events else None
+        if last_event:
+            analysts = last_event.get('analysts', '')
+            if analysts:
+                print_analysts("REVISED DRAFT WITH HUMAN FEEDBACK", analysts)
+
+        feedback_count += 1
+
+    final_state = await agraph.aget_state(thread)
+    analysts = final_state.values.get('analysts')
 
-    print(f"Analysts data saved to {filename}")
+    print_analysts("FINAL LIST", analysts)
+    save_analysts(analysts, thr)
+    await arelease_thread(agraph, thread)
 
     return analysts
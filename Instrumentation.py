@@ -0,0 +1,352 @@
+import contextvars
+import inspect
+import json
+import threading
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from Context_Window import estimate_tokens
+
+# Per-node timing, token and retrieval instrumentation for the analyst and interview graphs
+#
+# Every node is wrapped with instrument(). While metrics are enabled each node run emits one event:
+#   {"ts", "graph", "node", "thread_id", "interview_id", "analyst", "turn", "wall_time",
+#    "llm_calls", "prompt_tokens", "cached_tokens", "completion_tokens", "documents", "context_documents", "context_tokens", "error"}
+# Events are kept in memory (metrics.events(), metrics.summary()) and optionally appended to a JSONL file.
+
+RETRIEVAL_NODES = ("search_web", "search_wikipedia")
+TURN_NODES = ("ask_question", "generate_query", "search_web", "search_wikipedia", "answer_question", "compact_history")
+
+# USD per million (prompt, completion) tokens, for the per-role cost estimate
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+# Usage of the LLM calls made by the node currently running in this context
+_node_usage = contextvars.ContextVar("node_usage", default=None)
+
+
+class NodeUsage:
+    """ LLM usage accumulated during one node run """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.extra = {}
+
+    def add(self, prompt_tokens: int, completion_tokens: int, **extra):
+        with self.lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self._add_extra(extra)
+
+    def note(self, **extra):
+        """ Add counters to the node's event without counting an LLM call """
+        with self.lock:
+            self._add_extra(extra)
+
+    def _add_extra(self, extra):
+        for key, value in extra.items():
+            self.extra[key] = self.extra.get(key, 0) + value
+
+
+def current_usage():
+    """ Usage accumulator of the node running in this context, if any """
+    return _node_usage.get()
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """ Add the token usage of every LLM response to the node that made the call, and to its role and model """
+
+    run_inline = True
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self._calls = {}  # run_id -> (start, role, model)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, invocation_params=None, **kwargs):
+        metadata, invocation_params = metadata or {}, invocation_params or {}
+        model = invocation_params.get("model") or invocation_params.get("model_name") or metadata.get("ls_model_name") or "unknown"
+        self._calls[run_id] = (time.perf_counter(), metadata.get("llm_role") or metadata.get("langgraph_node") or "unknown", model)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._calls.pop(run_id, None)
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        call = self._calls.pop(run_id, None)
+        usage = _node_usage.get()
+        if usage is None and (call is None or self.metrics is None):
+            return
+        prompt_tokens = completion_tokens = cached_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                metadata = getattr(message, "usage_metadata", None) or {}
+                prompt_tokens += metadata.get("input_tokens", 0)
+                completion_tokens += metadata.get("output_tokens", 0)
+                # Prompt tokens served from the provider's prompt cache
+                cached_tokens += (metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+        if not prompt_tokens and response.llm_output:
+            token_usage = response.llm_output.get("token_usage") or {}
+            prompt_tokens = token_usage.get("prompt_tokens", 0)
+            completion_tokens = token_usage.get("completion_tokens", 0)
+            cached_tokens = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+        if usage is not None:
+            usage.add(prompt_tokens, completion_tokens, cached_tokens=cached_tokens)
+        if call is not None and self.metrics is not None:
+            start, role, model = call
+            self.metrics.record_llm_call(role, model, time.perf_counter() - start, prompt_tokens, completion_tokens, cached_tokens)
+
+
+class Metrics:
+    """ In-process store of node events, with an optional JSONL sink """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events = []
+        self._roles = {}  # (role, model) -> totals of its LLM calls
+        self._file = None
+        self.handler = UsageCallbackHandler(self)
+
+    def enable(self, jsonl_path: str = None):
+        """ Start recording; events are also appended to jsonl_path when given """
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+            self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
+            self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._events = []
+            self._roles = {}
+
+    def record_llm_call(self, role: str, model: str, latency: float, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        if not self.enabled:
+            return
+        with self._lock:
+            totals = self._roles.setdefault((role, model), {"llm_calls": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+            totals["llm_calls"] += 1
+            totals["latency"] += latency
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cached_tokens"] += cached_tokens
+
+    def roles(self) -> dict:
+        """ LLM calls, latency, tokens and estimated cost per role and model """
+        with self._lock:
+            items = [(role, model, dict(totals)) for (role, model), totals in self._roles.items()]
+        roles = {}
+        for role, model, totals in items:
+            prompt_price, completion_price = MODEL_PRICES.get(model, (None, None))
+            totals["mean_latency"] = totals["latency"] / totals["llm_calls"]
+            totals["cache_hit_rate"] = totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0
+            totals["cost"] = None if prompt_price is None else (totals["prompt_tokens"] * prompt_price + totals["completion_tokens"] * completion_price) / 1e6
+            roles.setdefault(role, {})[model] = totals
+        return roles
+
+    def emit(self, event: dict):
+        with self._lock:
+            self._events.append(event)
+            if self._file:
+                self._file.write(json.dumps(event, default=str) + "\n")
+                self._file.flush()
+
+    def events(self) -> list:
+        with self._lock:
+            return list(self._events)
+
+    def summary(self, slowest: int = 5) -> dict:
+        """ Totals per node, per interview and for the run, the savings of early exit, history summaries and prefetching, and the slowest interview turns """
+        events = self.events()
+
+        def totals(items):
+            prompt_tokens = sum(event["prompt_tokens"] for event in items)
+            cached_tokens = sum(event.get("cached_tokens", 0) for event in items)
+            return {
+                "node_runs": len(items),
+                "wall_time": sum(event["wall_time"] for event in items),
+                "llm_calls": sum(event["llm_calls"] for event in items),
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "cache_hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+                "completion_tokens": sum(event["completion_tokens"] for event in items),
+                "documents": sum(event["documents"] for event in items),
+                "errors": sum(1 for event in items if event.get("error")),
+                "escalations": sum(event.get("escalations", 0) for event in items),
+            }
+
+        by_node, by_interview, by_turn = {}, {}, {}
+        for event in events:
+            by_node.setdefault(event["node"], []).append(event)
+            if event.get("interview_id"):
+                by_interview.setdefault(event["interview_id"], []).append(event)
+                by_turn.setdefault((event["interview_id"], event.get("turn")), []).append(event)
+
+        nodes = {node: totals(items) for node, items in by_node.items()}
+        for node, items in by_node.items():
+            nodes[node]["mean_wall_time"] = nodes[node]["wall_time"] / len(items)
+            if node in RETRIEVAL_NODES:
+                nodes[node]["retrieval_latency"] = nodes[node]["mean_wall_time"]
+
+        interviews = {}
+        early_exit = {"interviews_stopped": 0, "skipped_turns": 0, "saved_llm_calls": 0, "saved_searches": 0, "saved_tokens": 0}
+        for interview_id, items in by_interview.items():
+            interviews[interview_id] = {
+                "analyst": items[0].get("analyst"),
+                "turns": max((event.get("turn") or 0) for event in items),
+                "max_context_tokens": max(event.get("context_tokens", 0) for event in items),
+                **totals(items),
+            }
+            skipped = sum(event.get("skipped_turns", 0) for event in items)
+            if skipped:
+                # Skipped turns are priced at this interview's average turn
+                turn_events = [event for event in items if event["node"] in TURN_NODES]
+                answers = sum(1 for event in turn_events if event["node"] == "answer_question")
+                turn_tokens = sum(event["prompt_tokens"] + event["completion_tokens"] for event in turn_events) / max(answers, 1)
+                interviews[interview_id]["skipped_turns"] = skipped
+                early_exit["interviews_stopped"] += 1
+                early_exit["skipped_turns"] += skipped
+                early_exit["saved_llm_calls"] += sum(event.get("saved_llm_calls", 0) for event in items)
+                early_exit["saved_searches"] += sum(event.get("saved_searches", 0) for event in items)
+                early_exit["saved_tokens"] += round(turn_tokens * skipped)
+
+        turns = [
+            {"interview_id": interview_id, "analyst": items[0].get("analyst"), "turn": turn, **totals(items)}
+            for (interview_id, turn), items in by_turn.items()
+        ]
+        turns.sort(key=lambda item: item["wall_time"], reverse=True)
+
+        # Prompt tokens the running summaries kept out, against what writing them cost
+        summaries = [event for event in events if event["node"] == "compact_history" and event["llm_calls"]]
+        history = {
+            "summaries": len(summaries),
+            "summary_tokens": sum(event["prompt_tokens"] + event["completion_tokens"] for event in summaries),
+            "tokens_saved": sum(event.get("history_tokens_saved", 0) for event in events),
+        }
+        history["net_tokens_saved"] = history["tokens_saved"] - history["summary_tokens"]
+
+        # Speculative searches started by answer_question, and how many of the later searches they served
+        prefetch = {
+            "issued": sum(event.get("prefetches", 0) for event in events),
+            "hits": sum(event.get("prefetch_hits", 0) for event in events),
+            "misses": sum(event.get("prefetch_misses", 0) for event in events),
+            "latency_saved": sum(event.get("prefetch_latency_saved", 0) for event in events),
+        }
+        prefetch["hit_rate"] = prefetch["hits"] / (prefetch["hits"] + prefetch["misses"]) if prefetch["hits"] + prefetch["misses"] else 0.0
+
+        return {"run": totals(events), "nodes": nodes, "roles": self.roles(), "interviews": interviews, "early_exit": early_exit,
+                "history": history, "prefetch": prefetch, "slowest_turns": turns[:slowest]}
+
+
+metrics = Metrics()
+
+
+def enable_metrics(jsonl_path: str = None) -> Metrics:
+    """ Start recording node metrics (and write them to jsonl_path as JSON lines) """
+    from Generate_Analysts import add_graph_callback
+
+    metrics.enable(jsonl_path)
+    add_graph_callback(metrics.handler)
+    return metrics
+
+
+def disable_metrics():
+    from Generate_Analysts import remove_graph_callback
+
+    metrics.disable()
+    remove_graph_callback(metrics.handler)
+
+
+def _accepts_config(node) -> bool:
+    try:
+        return "config" in inspect.signature(node).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _event(graph_name, name, state, turn, update, config, wall_time, usage, error):
+    analyst = state.get("analyst")
+    context = state.get("context") or []
+    documents = (update.get("context") or []) if isinstance(update, dict) else []
+    return {
+        "ts": time.time(),
+        "graph": graph_name,
+        "node": name,
+        "thread_id": ((config or {}).get("configurable") or {}).get("thread_id"),
+        "interview_id": state.get("interview_id"),
+        "analyst": getattr(analyst, "name", None),
+        "turn": turn,
+        "wall_time": wall_time,
+        "llm_calls": usage.llm_calls,
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        **usage.extra,
+        "documents": len(documents),
+        "context_documents": len(context),
+        "context_tokens": sum(estimate_tokens(doc["content"]) for doc in context if isinstance(doc, dict)),
+        "error": repr(error) if error else None,
+    }
+
+
+def _turn(state):
+    # Read before the node runs: generate_answer increments num_responses in place
+    return state["num_responses"] + 1 if "num_responses" in state else None
+
+
+def instrument(graph_name: str, name: str, node):
+    """ Wrap a graph node so each run emits a metrics event (a plain passthrough while metrics are disabled) """
+    accepts_config = _accepts_config(node)
+
+    if inspect.iscoroutinefunction(node):
+        async def anode(state, config):
+            if not metrics.enabled:
+                return await (node(state, config) if accepts_config else node(state))
+            usage, turn = NodeUsage(), _turn(state)
+            token = _node_usage.set(usage)
+            start = time.perf_counter()
+            update, error = None, None
+            try:
+                update = await (node(state, config) if accepts_config else node(state))
+                return update
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                _node_usage.reset(token)
+                metrics.emit(_event(graph_name, name, state, turn, update, config, time.perf_counter() - start, usage, error))
+        anode.__name__ = name
+        return anode
+
+    def wrapped(state, config):
+        if not metrics.enabled:
+            return node(state, config) if accepts_config else node(state)
+        usage, turn = NodeUsage(), _turn(state)
+        token = _node_usage.set(usage)
+        start = time.perf_counter()
+        update, error = None, None
+        try:
+            update = node(state, config) if accepts_config else node(state)
+            return update
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _node_usage.reset(token)
+            metrics.emit(_event(graph_name, name, state, turn, update, config, time.perf_counter() - start, usage, error))
+    wrapped.__name__ = name
+    return wrapped
@@ -0,0 +1,157 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from langchain_core.caches import BaseCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+# Content-addressed cache of chat model responses, with record and replay modes
+#
+# record: serve cached responses and record every new call
+# replay: serve cached responses only; a call that was never recorded raises LLMCacheMiss
+# off:    no caching
+
+LLM_CACHE_MODES = ("off", "record", "replay")
+
+# Message fields that change from run to run without changing what the model sees
+_VOLATILE_KEYS = ("id", "response_metadata", "usage_metadata")
+
+
+# Hit counter of the calls being made in this context (see counting_cache_hits); lookups in executor threads see it too
+_cache_hits = contextvars.ContextVar("llm_cache_hits", default=None)
+
+
+@contextlib.contextmanager
+def counting_cache_hits():
+    """ Count the cache hits of the calls made inside the block: yields a one-item list holding the count """
+    hits = [0]
+    token = _cache_hits.set(hits)
+    try:
+        yield hits
+    finally:
+        _cache_hits.reset(token)
+
+
+class LLMCacheMiss(KeyError):
+    """ Raised in replay mode when a call has no recorded response """
+
+
+def _normalize_prompt(prompt: str) -> str:
+    """ Drop message ids and response metadata from a serialized message list """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    if isinstance(messages, list):
+        for message in messages:
+            if isinstance(message, dict) and isinstance(message.get("kwargs"), dict):
+                for key in _VOLATILE_KEYS:
+                    message["kwargs"].pop(key, None)
+    return json.dumps(messages, sort_keys=True)
+
+
+def _json_default(value):
+    # Structured output keeps the parsed pydantic object in additional_kwargs["parsed"]; a dict parses back the same
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+def _dump_generations(generations) -> str:
+    """ Serialize generations as plain JSON """
+    return json.dumps([
+        {"text": gen.text, "generation_info": gen.generation_info, "message": message_to_dict(gen.message) if isinstance(gen, ChatGeneration) else None}
+        for gen in generations
+    ], default=_json_default)
+
+
+def _load_generations(data: str) -> list:
+    """ Rebuild generations saved by _dump_generations """
+    generations = []
+    for gen in json.loads(data):
+        if gen["message"] is not None:
+            generations.append(ChatGeneration(message=messages_from_dict([gen["message"]])[0], generation_info=gen["generation_info"]))
+        else:
+            generations.append(Generation(text=gen["text"], generation_info=gen["generation_info"]))
+    return generations
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """ Hash of the model parameters (model, temperature, structured output schema) and the messages """
+    return hashlib.sha256(f"{llm_string}\x00{_normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+class LLMCache(BaseCache):
+    """ SQLite-backed LangChain cache used by every chat model in the process """
+
+    def __init__(self, path: str = "llm_cache.sqlite", mode: str = "record"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, llm_string TEXT NOT NULL, generations TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = cache_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT generations FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if row is not None:
+            hits = _cache_hits.get()
+            if hits is not None:
+                hits[0] += 1
+            return _load_generations(row[0])
+        if self.mode == "replay":
+            raise LLMCacheMiss(f"No recorded response for LLM call {key[:12]} (replay mode)")
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        if self.mode == "replay":
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                (cache_key(prompt, llm_string), llm_string, _dump_generations(return_val), time.time())
+            )
+            self._conn.commit()
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+llm_cache = None
+
+
+def configure_llm_cache(mode: str = "record", path: str = "llm_cache.sqlite"):
+    """ Install (or remove, with mode="off") the LLM cache for all chat models """
+    global llm_cache
+    if mode not in LLM_CACHE_MODES:
+        raise ValueError(f"LLM cache mode must be one of {LLM_CACHE_MODES}, got {mode!r}")
+
+    llm_cache = None if mode == "off" else LLMCache(path, mode)
+    set_llm_cache(llm_cache)
+    return llm_cache
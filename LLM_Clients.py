@@ -0,0 +1,215 @@
+import asyncio
+import functools
+import threading
+import weakref
+from Rate_Limits import get_scheduler, scheduled_model
+from Instrumentation import current_usage
+
+# Registry of chat model clients shared by every graph run
+#
+# One client per (model, temperature[, structured output schema]), built on first use. All OpenAI clients send their
+# requests over one pooled HTTP connection, so concurrent interviews reuse warm connections. Async connections belong to
+# the event loop that opened them, so each event loop gets its own async pool and clients (a worker calling asyncio.run
+# once per topic gets fresh ones each time); the sync pool is shared by every thread.
+# Nodes never hold a client: they look it up from the "llm_model" / "llm_temperature" keys of the graph config.
+# Every call goes through the shared "llm" request scheduler (rate limits, retries, adaptive concurrency).
+# Each node asks for its role's model, so cheap, high-volume roles can run on smaller models (see set_model_tiers).
+
+# Chat model class; None means ChatOpenAI (imported on first use). Replaced by a fake model for offline benchmarks
+chat_model_factory = None
+
+# Model of each role (question, query, answer, summary, writing, analysts, review); see set_model_tiers
+model_tiers = {}
+
+# Connection pool shared by all OpenAI clients
+max_connections = 64
+max_keepalive_connections = 32
+http_timeout = 120.0
+
+_lock = threading.Lock()
+_models = {}
+_clients = {}
+_http_client = None
+_loop_clients = weakref.WeakKeyDictionary()  # Event loop -> (models, clients) built on it
+_async_http_clients = weakref.WeakKeyDictionary()  # Event loop -> its async connection pool
+
+
+@functools.lru_cache(maxsize=None)
+def load_environment():
+    """ Load environment variables from the .env file, once, before the first model or search client is built """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def set_chat_model_factory(factory):
+    """ Build chat models with another factory taking (model=..., temperature=...); None restores ChatOpenAI """
+    global chat_model_factory
+    with _lock:
+        chat_model_factory = factory
+        _models.clear()
+        _clients.clear()
+        _loop_clients.clear()
+
+
+def configure_http_pool(connections: int = 64, keepalive_connections: int = 32, timeout: float = 120.0):
+    """ Size the connection pool shared by the OpenAI clients; clients built from now on use the new pool """
+    global max_connections, max_keepalive_connections, http_timeout
+    max_connections, max_keepalive_connections, http_timeout = connections, keepalive_connections, timeout
+    reset_clients()
+
+
+def _http_limits():
+    import httpx
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+
+
+def http_client():
+    """ The sync httpx client shared by every thread, created on first use """
+    global _http_client
+    if _http_client is None:
+        import httpx
+        _http_client = httpx.Client(limits=_http_limits(), timeout=http_timeout)
+    return _http_client
+
+
+def async_http_client(loop):
+    """ The async httpx client of an event loop, created on first use there """
+    client = _async_http_clients.get(loop)
+    if client is None:
+        import httpx
+        client = _async_http_clients[loop] = httpx.AsyncClient(limits=_http_limits(), timeout=http_timeout)
+    return client
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _registry(loop):
+    """ (models, clients) cache of an event loop, or the shared one outside of any loop; called with _lock held """
+    if loop is None:
+        return _models, _clients
+    # Clients of closed loops can never be used again (their pool may keep the loop alive, so the weak keys are not enough)
+    for closed in [other for other in _loop_clients if other.is_closed()]:
+        del _loop_clients[closed]
+    for closed in [other for other in _async_http_clients if other.is_closed()]:
+        del _async_http_clients[closed]
+    return _loop_clients.setdefault(loop, ({}, {}))
+
+
+def _build_chat_model(llm_model: str, llm_temperature: float, loop=None):
+    load_environment()
+    if chat_model_factory is not None:
+        return chat_model_factory(model=llm_model, temperature=llm_temperature)
+
+    from langchain_openai import ChatOpenAI
+    async_client = async_http_client(loop) if loop is not None else None
+    # No SDK retries: the "llm" scheduler retries and backs off, and must see every 429 to adapt its limits
+    return ChatOpenAI(model=llm_model, temperature=llm_temperature, http_client=http_client(), http_async_client=async_client, max_retries=0)
+
+
+def get_chat_model(llm_model: str, llm_temperature: float, schema=None):
+    """ Shared chat model for (model, temperature) on the calling event loop, bound to a structured output schema when one is given """
+    key = (llm_model, llm_temperature, schema)
+    loop = _running_loop()
+    with _lock:
+        models, clients = _registry(loop)
+        client = clients.get(key)
+        if client is None:
+            model = models.get((llm_model, llm_temperature))
+            if model is None:
+                model = models[(llm_model, llm_temperature)] = _build_chat_model(llm_model, llm_temperature, loop)
+            client = clients[key] = scheduled_model(model if schema is None else model.with_structured_output(schema), get_scheduler("llm"))
+    return client
+
+
+def llm_config(llm_model: str, llm_temperature: float) -> dict:
+    """ Configurable keys telling the graph nodes which model to use """
+    return {"llm_model": llm_model, "llm_temperature": llm_temperature}
+
+
+def set_model_tiers(tiers: dict):
+    """ Choose the model of each role: {"query": "gpt-4.1-nano", "review": ["gpt-4.1-nano", None], "writing": "gpt-4o", ...}
+    A list is a cascade for structured output: the next model is tried when the output fails validation.
+    None (or a missing role) means the run's llm_model """
+    global model_tiers
+    model_tiers = dict(tiers or {})
+
+
+def role_models(config, role: str = None) -> list:
+    """ Models of a role, in cascade order """
+    configurable = (config or {}).get("configurable", {})
+    tiers = configurable.get("model_tiers", model_tiers)
+    models = tiers.get(role) if role else None
+    if not models:
+        return [configurable["llm_model"]]
+    models = [models] if isinstance(models, str) else models
+    return list(dict.fromkeys(model or configurable["llm_model"] for model in models))
+
+
+def _cascade(clients: list, role: str):
+    """ Try each structured output client in turn, moving on when the output fails validation """
+    from langchain_core.exceptions import OutputParserException
+    from langchain_core.runnables import RunnableLambda
+    from pydantic import ValidationError
+
+    def escalated():
+        usage = current_usage()
+        if usage is not None:
+            usage.note(escalations=1)
+
+    def invoke(messages, config):
+        for client in clients[:-1]:
+            try:
+                return client.invoke(messages, config)
+            except (OutputParserException, ValidationError, ValueError):
+                escalated()
+        return clients[-1].invoke(messages, config)
+
+    async def ainvoke(messages, config):
+        for client in clients[:-1]:
+            try:
+                return await client.ainvoke(messages, config)
+            except (OutputParserException, ValidationError, ValueError):
+                escalated()
+        return await clients[-1].ainvoke(messages, config)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"cascade_{role}")
+
+
+def chat_model(config, schema=None, role: str = None):
+    """ Chat model for a role, selected by the model tiers and the llm_model / llm_temperature keys of a node's config """
+    configurable = (config or {}).get("configurable", {})
+    temperature = configurable["llm_temperature"]
+    models = role_models(config, role)
+
+    if len(models) == 1 or schema is None:
+        client = get_chat_model(models[0], temperature, schema)
+    else:
+        key = (tuple(models), temperature, schema)
+        loop = _running_loop()
+        with _lock:
+            client = _registry(loop)[1].get(key)
+        if client is None:
+            client = _cascade([get_chat_model(model, temperature, schema) for model in models], role)
+            with _lock:
+                _registry(loop)[1][key] = client
+
+    # The role is passed on to the callbacks, for per-role latency and cost accounting
+    return client.with_config(metadata={"llm_role": role}) if role else client
+
+
+def reset_clients():
+    """ Drop every cached client and close the shared connection pool """
+    global _http_client
+    with _lock:
+        _models.clear()
+        _clients.clear()
+        _loop_clients.clear()
+        _async_http_clients.clear()  # Each async pool belongs to its event loop; they are left to the garbage collector
+        client, _http_client = _http_client, None
+    if client is not None:
+        client.close()
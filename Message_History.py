@@ -0,0 +1,87 @@
+from langchain_core.messages import SystemMessage, HumanMessage, get_buffer_string
+from Context_Window import estimate_tokens
+from Instrumentation import current_usage
+from LLM_Clients import chat_model
+
+# Rolling summary of the interview transcript
+#
+# The question, query and answer prompts get the last keep_exchanges question/answer pairs verbatim. Older messages are
+# folded into a running summary by the compact_history node, a few at a time, so each turn costs about the same however
+# long the interview runs. The full transcript stays in the state for the report.
+
+keep_exchanges = 3  # Question/answer pairs sent verbatim
+fold_min_messages = 4  # Fold only once this many messages fell out of the window, so summaries are batched
+summary_words = 250  # Length the running summary is kept under
+
+summary_instructions = """You are keeping notes of an interview between an analyst and an expert.
+
+Update the running summary with the new part of the interview. Keep every fact, figure and source citation (e.g. [3]) the expert gave, and the questions the analyst already asked so they are not asked again.
+
+Keep the summary under {words} words.
+
+Current summary:
+{summary}
+
+New part of the interview:
+{exchanges}"""
+
+
+def messages_to_fold(state: dict) -> list:
+    """ Messages that fell out of the verbatim window and are not in the summary yet """
+    messages = state["messages"]
+    end = len(messages) - 2 * keep_exchanges
+    start = state.get("summarized", 0)
+    return messages[start:end] if end - start >= fold_min_messages else []
+
+
+def _summary_update(state: dict, summary: str, folded: list) -> dict:
+    return {"summary": summary, "summarized": state.get("summarized", 0) + len(folded)}
+
+
+def compact_history(state: dict, config):
+    """ Node to fold older messages into the running summary """
+    folded = messages_to_fold(state)
+    if not folded:
+        return {}
+
+    prompt = summary_instructions.format(words=summary_words, summary=state.get("summary") or "(none yet)", exchanges=get_buffer_string(folded))
+    summary = chat_model(config, role="summary").invoke([SystemMessage(content=prompt), HumanMessage(content="Write the updated summary.")])
+    return _summary_update(state, summary.content, folded)
+
+
+async def acompact_history(state: dict, config):
+    """ Node to fold older messages into the running summary (async) """
+    folded = messages_to_fold(state)
+    if not folded:
+        return {}
+
+    prompt = summary_instructions.format(words=summary_words, summary=state.get("summary") or "(none yet)", exchanges=get_buffer_string(folded))
+    summary = await chat_model(config, role="summary").ainvoke([SystemMessage(content=prompt), HumanMessage(content="Write the updated summary.")])
+    return _summary_update(state, summary.content, folded)
+
+
+def recent_history(state: dict, instructions: str, persona: str = None, documents: str = None) -> list:
+    """ Prompt for the next interview message, stable parts first so consecutive turns share a cacheable prefix:
+    instructions, persona, summary of the folded messages, the messages not folded yet, and the documents last """
+    messages = state["messages"]
+    summarized = state.get("summarized", 0)
+    summary = state.get("summary")
+
+    prompt = [SystemMessage(content=instructions)]
+    if persona:
+        prompt.append(SystemMessage(content=persona))
+
+    if summary and summarized:
+        # Report what the summary keeps out of this prompt with the node's metrics event
+        usage = current_usage()
+        if usage is not None:
+            folded_tokens = sum(estimate_tokens(message.content) for message in messages[:summarized])
+            usage.note(history_tokens_saved=max(0, folded_tokens - estimate_tokens(summary)))
+
+        prompt.append(SystemMessage(content=f"Summary of the earlier part of the interview:\n{summary}"))
+        messages = messages[summarized:]
+
+    prompt += messages
+    if documents:
+        prompt.append(SystemMessage(content=documents))
+    return prompt
@@ -0,0 +1,262 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from Context_Window import terms
+from Retrieval_Cache import get_retriever
+from Instrumentation import current_usage
+
+# Speculative retrieval: search for the likely next query while the current turn is still running
+#
+# A turn is strictly serial (question -> query -> search -> answer), so each turn waits for its searches. With
+# prefetching on, answer_question starts searches for the likely follow-up before the expert answers (the question's
+# query and the analyst's goals), and again once the answer is known (its key terms). They run while the answer,
+# the history summary, the next question and its query are generated. The next search_web / search_wikipedia takes
+# the prefetched results when their query shares enough terms with its own, waiting for them if still in flight.
+# Prefetched results are kept per interview for a short time; unused ones are counted as wasted.
+
+prefetch_enabled = False  # Off by default: speculative searches spend search quota that may go unused
+prefetch_ttl = 120.0  # Seconds a prefetched result stays usable
+match_threshold = 0.5  # Share of terms (of the longer of the two queries) a prefetched query must share with the real one
+query_terms = 6  # Terms in a candidate query
+prefetch_sources = ("web", "wikipedia")
+prefetch_workers = 8  # Threads running the speculative searches of the sync graph
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="prefetch")
+        return _executor
+
+
+def query_match(prefetched: set, requested: set) -> float:
+    """ Terms two queries share, over the size of the longer one """
+    if not prefetched or not requested:
+        return 0.0
+    return len(prefetched & requested) / max(len(prefetched), len(requested))
+
+
+class PrefetchCache:
+    """ Short-lived, per interview store of in-flight and finished speculative searches """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # interview_id -> [{"source", "query", "terms", "future", "started"}]
+        self._searched = {}  # interview_id -> terms of every query the interview searched for
+        self.issued = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        self.latency_saved = 0.0
+
+    def _expire(self, entries: list, now: float) -> list:
+        fresh = [entry for entry in entries if now - entry["started"] <= prefetch_ttl]
+        self.wasted += len(entries) - len(fresh)
+        return fresh
+
+    def searched_terms(self, interview_id: str) -> set:
+        with self._lock:
+            return set(self._searched.get(interview_id, ()))
+
+    def add(self, interview_id: str, source: str, query: str, start) -> bool:
+        """ Start a speculative search with start() unless the interview already has one for the same terms """
+        query_terms = set(terms(query))
+        now = time.monotonic()
+        with self._lock:
+            entries = self._expire(self._entries.get(interview_id, []), now)
+            self._entries[interview_id] = entries
+            if not query_terms or any(entry["source"] == source and entry["terms"] == query_terms for entry in entries):
+                return False
+            entries.append({"source": source, "query": query, "terms": query_terms, "future": start(), "started": now})
+            self.issued += 1
+        return True
+
+    def take(self, interview_id: str, source: str, query: str):
+        """ Remove and return the best matching prefetched search for a query, or None """
+        requested = set(terms(query))
+        now = time.monotonic()
+        with self._lock:
+            self._searched.setdefault(interview_id, set()).update(requested)
+            entries = self._expire(self._entries.get(interview_id, []), now)
+            scored = [(query_match(entry["terms"], requested), entry) for entry in entries if entry["source"] == source]
+            score, best = max(scored, key=lambda item: item[0], default=(0.0, None))
+            if best is None or score < match_threshold:
+                self._entries[interview_id] = entries
+                self.misses += 1
+                return None
+            entries.remove(best)
+            self._entries[interview_id] = entries
+            return best
+
+    def record_hit(self, latency_saved: float):
+        with self._lock:
+            self.hits += 1
+            self.latency_saved += latency_saved
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def release(self, interview_id: str):
+        """ Drop an interview's speculative searches once it is over; the ones not used yet are wasted """
+        with self._lock:
+            entries = self._entries.pop(interview_id, [])
+            self._searched.pop(interview_id, None)
+            self.wasted += len(entries)
+        for entry in entries:
+            entry["future"].cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            searches = self.hits + self.misses
+            return {
+                "issued": self.issued,
+                "hits": self.hits,
+                "misses": self.misses,
+                "wasted": self.wasted,
+                "hit_rate": self.hits / searches if searches else 0.0,
+                "used_rate": self.hits / self.issued if self.issued else 0.0,
+                "latency_saved": self.latency_saved,
+            }
+
+
+prefetch_cache = PrefetchCache()
+
+
+def configure_prefetch(enabled: bool = True, ttl: float = None, threshold: float = None):
+    """ Turn speculative retrieval on or off, starting with an empty prefetch cache and fresh counters """
+    global prefetch_enabled, prefetch_ttl, match_threshold, prefetch_cache
+    prefetch_enabled = enabled
+    prefetch_ttl = prefetch_ttl if ttl is None else ttl
+    match_threshold = match_threshold if threshold is None else threshold
+    prefetch_cache = PrefetchCache()
+
+
+def prefetch_stats() -> dict:
+    return prefetch_cache.stats()
+
+
+def key_terms(text: str, exclude: set, count: int) -> list:
+    """ Most frequent content words of a text that are not excluded """
+    counts = Counter(term for term in terms(text) if term not in exclude)
+    return [term for term, _ in counts.most_common(count)]
+
+
+def candidate_queries(state: dict, answer: str = None) -> list:
+    """ Likely next search queries: the current query's leading terms, plus terms not searched yet from the analyst's
+    goals and the question (while the answer is generated) or from the answer (once it is known) """
+    if not state.get("search_query"):
+        return []
+    current = list(dict.fromkeys(terms(state["search_query"])))
+    base = current[:query_terms // 2]
+    searched = prefetch_cache.searched_terms(state["interview_id"]) | set(current)
+    text = answer if answer is not None else f"{state['messages'][-1].content} {state['analyst'].persona}"
+    new = key_terms(text, searched, query_terms - len(base))
+    return [" ".join(base + new)] if new else []
+
+
+def _worth_prefetching(state: dict) -> bool:
+    # No next turn once this one reaches max_num_questions
+    return bool(prefetch_enabled and state.get("interview_id")) and state["num_responses"] + 1 < state["max_num_questions"]
+
+
+def _timed_search(retriever, query: str):
+    try:
+        documents = retriever.search(query)
+    except Exception:
+        documents = None
+    return documents, time.monotonic()
+
+
+async def _atimed_search(retriever, query: str):
+    try:
+        documents = await retriever.asearch(query)
+    except Exception:
+        documents = None
+    return documents, time.monotonic()
+
+
+def _note(**counters):
+    usage = current_usage()
+    if usage is not None:
+        usage.note(**counters)
+
+
+def prefetch(state: dict, answer: str = None) -> int:
+    """ Start the speculative searches for the next turn on the prefetch threads; returns how many were started """
+    if not _worth_prefetching(state):
+        return 0
+    started = 0
+    for query in candidate_queries(state, answer):
+        for source in prefetch_sources:
+            retriever = get_retriever(source)
+            started += prefetch_cache.add(state["interview_id"], source, query, lambda: executor().submit(_timed_search, retriever, query))
+    _note(prefetches=started)
+    return started
+
+
+async def aprefetch(state: dict, answer: str = None) -> int:
+    """ Start the speculative searches for the next turn as tasks of the running event loop """
+    if not _worth_prefetching(state):
+        return 0
+    started = 0
+    for query in candidate_queries(state, answer):
+        for source in prefetch_sources:
+            retriever = get_retriever(source)
+            started += prefetch_cache.add(state["interview_id"], source, query, lambda: asyncio.ensure_future(_atimed_search(retriever, query)))
+    _note(prefetches=started)
+    return started
+
+
+def _use(entry: dict, requested_at: float, documents, finished: float):
+    """ Count a prefetched search that is used: it saved its duration, less the time the search node still waited for it """
+    if documents is None:
+        prefetch_cache.record_miss()
+        _note(prefetch_misses=1)
+        return None
+    saved = max(0.0, (finished - entry["started"]) - max(0.0, finished - requested_at))
+    prefetch_cache.record_hit(saved)
+    _note(prefetch_hits=1, prefetch_latency_saved=saved)
+    return documents
+
+
+def prefetched_search(state: dict, source: str) -> list:
+    """ Documents for the state's search query: the prefetched ones when a speculative search matched it, else a search """
+    query = state["search_query"]
+    if prefetch_enabled and state.get("interview_id"):
+        requested_at = time.monotonic()
+        entry = prefetch_cache.take(state["interview_id"], source, query)
+        if entry is not None and not isinstance(entry["future"], asyncio.Future):
+            documents = _use(entry, requested_at, *entry["future"].result())
+            if documents is not None:
+                return documents
+        elif entry is None:
+            _note(prefetch_misses=1)
+    return get_retriever(source).search(query)
+
+
+async def aprefetched_search(state: dict, source: str) -> list:
+    """ Async version of prefetched_search """
+    query = state["search_query"]
+    if prefetch_enabled and state.get("interview_id"):
+        requested_at = time.monotonic()
+        entry = prefetch_cache.take(state["interview_id"], source, query)
+        if entry is not None:
+            future = entry["future"]
+            documents = _use(entry, requested_at, *await (future if isinstance(future, asyncio.Future) else asyncio.wrap_future(future)))
+            if documents is not None:
+                return documents
+        else:
+            _note(prefetch_misses=1)
+    return await get_retriever(source).asearch(query)
+
+
+def release_prefetches(interview_id: str):
+    """ Drop what an interview prefetched once it is saved """
+    prefetch_cache.release(interview_id)
@@ -0,0 +1,382 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from Context_Window import estimate_tokens
+
+# Rate-limit-aware scheduling of every LLM and search request
+#
+# Each backend ("llm", "web", "wikipedia") has one RequestScheduler shared by all interviews. It holds:
+#   - token buckets for requests per minute and tokens per minute,
+#   - retries with jittered exponential backoff on 429s and transient server errors (honouring Retry-After), with a
+#     default budget that outlasts a one-minute rate-limit window,
+#   - an adaptive concurrency limit: +1/limit per success, halved on throttling (AIMD),
+#   - an adaptive request rate: a 429 lowers the requests-per-minute bucket to half the rate the endpoint was accepting
+#     (successes of the last minute over the time they span), creating the bucket when none is configured, but never
+#     below rate_floor of the configured rate. After recovery_interval seconds without a 429 the rate grows by
+#     rate_recovery, back up to the configured rate. Fewer concurrent calls alone cannot bring a fast endpoint under a
+#     per-minute limit.
+
+# Transient HTTP statuses worth retrying; only 429 lowers the concurrency limit
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+RETRYABLE_ERRORS = ("RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError")
+
+# Default limits per backend; None means no limit
+SCHEDULER_LIMITS = {
+    "llm": {"requests_per_minute": 500, "tokens_per_minute": 200000, "max_concurrency": 16},
+    "web": {"requests_per_minute": 100, "max_concurrency": 8},
+    "wikipedia": {"requests_per_minute": 200, "max_concurrency": 8},
+}
+
+
+def status_code(error):
+    """ HTTP status of an SDK or HTTP client error, if it carries one """
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code
+
+
+def is_rate_limited(error) -> bool:
+    return status_code(error) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_retryable(error) -> bool:
+    return status_code(error) in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+
+
+def retry_after(error):
+    """ Seconds asked for by a Retry-After header, if any """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """ Allow `per_minute` units per minute, with bursts of up to one minute's worth """
+
+    def __init__(self, per_minute: float, level: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute if level is None else level
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def per_minute(self) -> float:
+        return self.capacity
+
+    def reserve(self, amount: float) -> float:
+        """ Take `amount` units, going into debt if needed; returns how long to wait before using them """
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= min(amount, self.capacity)
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount: float):
+        """ Charge (or refund, when negative) the difference between an estimate and actual usage """
+        with self.lock:
+            self.level = min(self.capacity, self.level - amount)
+
+    def set_rate(self, per_minute: float, drain: bool = False):
+        """ Change the rate; drain drops the saved-up burst, so the new rate applies from the next request """
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = per_minute / 60.0
+            self.capacity = per_minute
+            self.level = min(self.level, 0.0 if drain else per_minute)
+
+
+class RequestScheduler:
+    """ Shared gate in front of one backend: rate limits, retries and adaptive concurrency """
+
+    def __init__(self, name: str, requests_per_minute: float = None, tokens_per_minute: float = None, max_concurrency: int = 16,
+                 min_concurrency: int = 1, max_retries: int = 10, base_delay: float = 0.5, max_delay: float = 60.0, cooldown: float = 1.0,
+                 min_requests_per_minute: float = 1.0, rate_floor: float = 0.1, rate_recovery: float = 1.5, recovery_interval: float = 10.0):
+        # Default retry budget: 10 retries with backoff capped at 60s wait at least ~2 minutes (at the lowest jitter),
+        # so a request throttled at the start of a one-minute window is still retried after the window resets
+        self.name = name
+        self.requests_per_minute = requests_per_minute  # Configured ceiling of the adaptive request rate
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cooldown = cooldown  # Throttles within this many seconds of a decrease count as one
+        self.min_requests_per_minute = min_requests_per_minute
+        self.rate_floor = rate_floor  # Lowest share of the configured rate a 429 brings the rate down to
+        self.rate_recovery = rate_recovery  # Factor a lowered rate grows by per recovery_interval without a 429
+        self.recovery_interval = recovery_interval
+        self.last_rate_change = None  # When the rate was last lowered or raised; None when it is not lowered
+        self.accepted = deque()  # When the successful requests of the last minute finished
+
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+        self.calls = 0
+        self.cached = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.wait_time = 0.0
+
+    # Admission
+    def _reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        with self.condition:
+            wait = max(wait, self.paused_until - time.monotonic())
+            self.wait_time += max(wait, 0.0)
+        return wait
+
+    def _try_enter(self) -> bool:
+        if self.active < max(self.min_concurrency, int(self.limit)):
+            self.active += 1
+            return True
+        return False
+
+    def _enter(self):
+        with self.condition:
+            while not self._try_enter():
+                self.condition.wait(0.05)
+
+    async def _aenter(self):
+        while True:
+            with self.condition:
+                if self._try_enter():
+                    return
+            await asyncio.sleep(0.01)
+
+    def _leave(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    # Feedback
+    def _accepted_per_minute(self, now: float):
+        """ Rate the endpoint accepted over the last minute, over the time those successes actually span (None if none) """
+        while self.accepted and now - self.accepted[0] > 60.0:
+            self.accepted.popleft()
+        if not self.accepted:
+            return None
+        return len(self.accepted) * 60.0 / max(1.0, now - self.accepted[0])
+
+    def _on_success(self):
+        with self.condition:
+            self.calls += 1
+            now = time.monotonic()
+            self._accepted_per_minute(now)  # Keeps only the last minute
+            self.accepted.append(now)
+            if self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            if self.last_rate_change is not None and now - self.last_rate_change >= self.recovery_interval:
+                self._raise_rate(now)
+
+    def _raise_rate(self, now: float):
+        """ Grow a lowered rate back towards the configured one (an adaptive bucket is dropped once it no longer binds) """
+        rate = self.requests.per_minute * self.rate_recovery
+        if self.requests_per_minute is None and rate > 2 * (self._accepted_per_minute(now) or 0.0):
+            self.requests, self.last_rate_change = None, None
+        elif self.requests_per_minute is not None and rate >= self.requests_per_minute:
+            self.requests.set_rate(self.requests_per_minute)
+            self.last_rate_change = None
+        else:
+            self.requests.set_rate(rate)
+            self.last_rate_change = now
+
+    def _lower_rate(self, now: float):
+        """ Halve the request rate the endpoint was accepting, down to the floor; lowering an already lower rate is a no-op """
+        accepted = self._accepted_per_minute(now)
+        if accepted is None:
+            return  # Nothing to estimate the endpoint's rate from: the backoff alone slows down
+        floor = max(self.min_requests_per_minute, self.rate_floor * (self.requests_per_minute or 0.0))
+        current = self.requests.per_minute if self.requests else accepted
+        rate = max(floor, min(current, accepted / 2))
+        if self.requests is None:
+            self.requests = TokenBucket(rate, level=0.0)
+        else:
+            self.requests.set_rate(rate, drain=True)
+        self.last_rate_change = now
+
+    def _on_retry(self, attempt: int, error) -> float:
+        """ Record a retryable failure and return the backoff delay before the next attempt """
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = max(random.uniform(delay / 2, delay), retry_after(error) or 0.0)
+        with self.condition:
+            self.retries += 1
+            if is_rate_limited(error):
+                self.throttled += 1
+                now = time.monotonic()
+                if now - self.last_decrease > self.cooldown:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._lower_rate(now)
+                    self.last_decrease = now
+                # Everyone backs off, not just the request that was throttled
+                self.paused_until = max(self.paused_until, now + delay / 2)
+        return delay
+
+    def _on_failure(self):
+        with self.condition:
+            self.failures += 1
+
+    def refund(self, tokens: int = 0):
+        """ Give back the request and token budget of a call that was served from a local cache, sending nothing to the backend """
+        if self.requests:
+            self.requests.adjust(-1)
+        if self.tokens and tokens:
+            self.tokens.adjust(-tokens)
+        with self.condition:
+            self.calls -= 1
+            self.cached += 1
+
+    def charge_tokens(self, tokens: int):
+        """ Correct the tokens-per-minute bucket once a call's actual usage is known """
+        if self.tokens and tokens:
+            self.tokens.adjust(tokens)
+
+    # Calls
+    def call(self, fn, tokens: int = 0):
+        """ Run fn() within the limits, retrying throttled and transient failures with jittered backoff """
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(tokens)
+            if wait > 0:
+                time.sleep(wait)
+            self._enter()
+            try:
+                result = fn()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    self._on_failure()
+                    raise
+                delay = self._on_retry(attempt, e)
+            else:
+                self._on_success()
+                return result
+            finally:
+                self._leave()
+            time.sleep(delay)
+
+    async def acall(self, fn, tokens: int = 0):
+        """ Async version of call: fn() returns an awaitable """
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._aenter()
+            try:
+                result = await fn()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    self._on_failure()
+                    raise
+                delay = self._on_retry(attempt, e)
+            else:
+                self._on_success()
+                return result
+            finally:
+                self._leave()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "calls": self.calls,
+                "cached": self.cached,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "wait_time": self.wait_time,
+                "concurrency_limit": self.limit,
+                "requests_per_minute": self.requests.per_minute if self.requests else None,
+            }
+
+
+schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def configure_scheduler(name: str, **limits) -> RequestScheduler:
+    """ Replace the scheduler of a backend, e.g. with the limits of your API tier """
+    with _schedulers_lock:
+        schedulers[name] = RequestScheduler(name, **limits)
+        return schedulers[name]
+
+
+def get_scheduler(name: str) -> RequestScheduler:
+    """ Shared scheduler of a backend, created with SCHEDULER_LIMITS on first use """
+    with _schedulers_lock:
+        if name not in schedulers:
+            schedulers[name] = RequestScheduler(name, **SCHEDULER_LIMITS.get(name, {}))
+        return schedulers[name]
+
+
+def scheduler_stats() -> dict:
+    with _schedulers_lock:
+        return {name: scheduler.stats() for name, scheduler in schedulers.items()}
+
+
+def _prompt_tokens(messages) -> int:
+    if isinstance(messages, str):
+        return estimate_tokens(messages)
+    return sum(estimate_tokens(message.content) for message in messages if isinstance(getattr(message, "content", None), str))
+
+
+def scheduled_model(model, scheduler: RequestScheduler, completion_tokens: int = 500):
+    """ Wrap a chat model (or structured output runnable) so every call goes through the scheduler.
+    Calls answered by the LLM cache give their request and token budget back, since they reach no API """
+    from langchain_core.runnables import RunnableLambda
+    from LLM_Cache import counting_cache_hits
+
+    def charge(estimate, result, cache_hits):
+        if cache_hits:
+            scheduler.refund(estimate)
+            return
+        usage = getattr(result, "usage_metadata", None)
+        if usage:
+            scheduler.charge_tokens(usage.get("total_tokens", 0) - estimate)
+
+    def invoke(messages, config):
+        estimate = _prompt_tokens(messages) + completion_tokens
+        with counting_cache_hits() as hits:
+            result = scheduler.call(lambda: model.invoke(messages, config), estimate)
+        charge(estimate, result, hits[0])
+        return result
+
+    async def ainvoke(messages, config):
+        estimate = _prompt_tokens(messages) + completion_tokens
+        with counting_cache_hits() as hits:
+            result = await scheduler.acall(lambda: model.ainvoke(messages, config), estimate)
+        charge(estimate, result, hits[0])
+        return result
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"scheduled_{scheduler.name}")
+
+
+class ScheduledRetriever:
+    """ Send a retriever's searches through its backend's scheduler """
+
+    def __init__(self, retriever, scheduler: RequestScheduler):
+        self.retriever = retriever
+        self.scheduler = scheduler
+        self.source = retriever.source
+
+    def search(self, query: str) -> list:
+        return self.scheduler.call(lambda: self.retriever.search(query))
+
+    async def asearch(self, query: str) -> list:
+        return await self.scheduler.acall(lambda: self.retriever.asearch(query))
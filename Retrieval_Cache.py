@@ -0,0 +1,186 @@
+import json
+import sqlite3
+import threading
+import time
+from Rate_Limits import ScheduledRetriever, get_scheduler
+from LLM_Clients import load_environment
+
+# Pluggable search backends with a persistent on-disk cache in front of them
+
+
+def normalize_query(query: str) -> str:
+    """ Normalize a search query so trivially different spellings share a cache entry """
+    return " ".join(query.lower().split())
+
+
+class TavilyRetriever:
+    """ Web search through Tavily. Documents are returned as {"url", "content"} dicts """
+
+    source = "web"
+
+    def __init__(self, max_results: int = 3):
+        self.max_results = max_results
+
+    def search(self, query: str) -> list:
+        from langchain_community.tools.tavily_search import TavilySearchResults
+        load_environment()  # TAVILY_API_KEY may only be in .env
+        search_docs = TavilySearchResults(max_results=self.max_results).invoke(query)
+        return [{"url": doc["url"], "content": doc["content"]} for doc in search_docs]
+
+    async def asearch(self, query: str) -> list:
+        from langchain_community.tools.tavily_search import TavilySearchResults
+        load_environment()  # TAVILY_API_KEY may only be in .env
+        search_docs = await TavilySearchResults(max_results=self.max_results).ainvoke(query)
+        return [{"url": doc["url"], "content": doc["content"]} for doc in search_docs]
+
+
+class WikipediaRetriever:
+    """ Wikipedia pages. Documents are returned as {"source", "page", "content"} dicts """
+
+    source = "wikipedia"
+
+    def __init__(self, load_max_docs: int = 2):
+        self.load_max_docs = load_max_docs
+
+    @staticmethod
+    def _to_dicts(search_docs) -> list:
+        return [
+            {"source": doc.metadata["source"], "page": doc.metadata.get("page", ""), "content": doc.page_content}
+            for doc in search_docs
+        ]
+
+    def search(self, query: str) -> list:
+        from langchain_community.document_loaders import WikipediaLoader
+        return self._to_dicts(WikipediaLoader(query=query, load_max_docs=self.load_max_docs).load())
+
+    async def asearch(self, query: str) -> list:
+        from langchain_community.document_loaders import WikipediaLoader
+        return self._to_dicts(await WikipediaLoader(query=query, load_max_docs=self.load_max_docs).aload())
+
+
+class RetrievalCache:
+    """ SQLite cache of search results keyed by (source, normalized query), with a TTL and LRU eviction """
+
+    def __init__(self, path: str = "retrieval_cache.sqlite", ttl: float = 7 * 24 * 3600, max_entries: int = 5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_cache ("
+            "source TEXT NOT NULL, query TEXT NOT NULL, documents TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (source, query))"
+        )
+        self._conn.commit()
+
+    def get(self, source: str, query: str):
+        """ Return the cached documents, or None on a miss or an expired entry """
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT documents, created_at FROM retrieval_cache WHERE source = ? AND query = ?", (source, key)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM retrieval_cache WHERE source = ? AND query = ?", (source, key))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE retrieval_cache SET accessed_at = ? WHERE source = ? AND query = ?", (now, source, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, source: str, query: str, documents: list):
+        """ Store documents and evict the least recently used entries beyond max_entries """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO retrieval_cache VALUES (?, ?, ?, ?, ?)",
+                (source, normalize_query(query), json.dumps(documents), now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM retrieval_cache WHERE rowid IN ("
+                "SELECT rowid FROM retrieval_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM retrieval_cache")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM retrieval_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "entries": entries}
+
+
+class CachedRetriever:
+    """ Serve a retriever's results from the cache, falling back to the retriever on a miss """
+
+    def __init__(self, retriever, cache: RetrievalCache):
+        self.retriever = retriever
+        self.cache = cache
+        self.source = retriever.source
+
+    def search(self, query: str) -> list:
+        documents = self.cache.get(self.source, query)
+        if documents is None:
+            documents = self.retriever.search(query)
+            self.cache.set(self.source, query, documents)
+        return documents
+
+    async def asearch(self, query: str) -> list:
+        documents = self.cache.get(self.source, query)
+        if documents is None:
+            documents = await self.retriever.asearch(query)
+            self.cache.set(self.source, query, documents)
+        return documents
+
+
+# Backends used by the interview graph, by source name
+retrievers = {
+    "web": TavilyRetriever(max_results=3),
+    "wikipedia": WikipediaRetriever(load_max_docs=2),
+}
+retrieval_cache = None
+_cache_lock = threading.Lock()
+
+
+def set_retriever(source: str, retriever):
+    """ Replace the backend for a source, e.g. with a local fake for offline runs """
+    retrievers[source] = retriever
+
+
+def configure_retrieval_cache(path: str = "retrieval_cache.sqlite", ttl: float = 7 * 24 * 3600, max_entries: int = 5000, enabled: bool = True):
+    """ Set up (or turn off) the shared retrieval cache """
+    global retrieval_cache
+    with _cache_lock:
+        retrieval_cache = RetrievalCache(path, ttl, max_entries) if enabled else False
+    return retrieval_cache
+
+
+def get_retrieval_cache():
+    """ Shared retrieval cache, created with default settings on first use """
+    global retrieval_cache
+    with _cache_lock:
+        if retrieval_cache is None:
+            retrieval_cache = RetrievalCache()
+        return retrieval_cache
+
+
+def get_retriever(source: str):
+    """ Retriever for a source, rate limited by its scheduler and wrapped in the shared cache unless caching is turned off """
+    cache = get_retrieval_cache()
+    retriever = ScheduledRetriever(retrievers[source], get_scheduler(source))
+    return CachedRetriever(retriever, cache) if cache else retriever
@@ -0,0 +1,220 @@
+import argparse
+import json
+import sqlite3
+import threading
+import time
+
+# Append-only archive of every run's outputs, in one SQLite file
+#
+# Each record is one JSON document of a kind, written in its own transaction as soon as the node producing it finishes:
+#   analysts   the final analyst list
+#   turn       one question/answer exchange of an interview (with its search query and information gain)
+#   transcript the full interview and documents the context documents it cited, when the interview is saved
+#   section    the report section of an interview, with its content hash
+#   report_part / report   the introduction and conclusion, and the final report
+#   metrics    the metrics summary of a run
+# Records are never updated or deleted: the latest record of a kind (per analyst) is the current one. Records are
+# indexed by run, topic and analyst, so a batch can be queried or resumed without reading thousands of small files.
+# Markdown and HTML are rendered from the archive on demand (render_run, or `python Run_Archive.py render RUN`).
+
+run_archive_path = "run_archive.sqlite"
+
+
+class RunArchive:
+    """ SQLite archive of runs: a runs table and an append-only table of JSON records """
+
+    def __init__(self, path: str = "run_archive.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "run_id TEXT PRIMARY KEY, topic TEXT NOT NULL, created_at REAL NOT NULL, info TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT NOT NULL, topic TEXT, analyst TEXT, kind TEXT NOT NULL, "
+            "created_at REAL NOT NULL, data TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS records_by_run ON records (run_id, kind, analyst);"
+            "CREATE INDEX IF NOT EXISTS records_by_topic ON records (topic, kind);"
+            "CREATE INDEX IF NOT EXISTS records_by_analyst ON records (analyst, kind);"
+            "CREATE INDEX IF NOT EXISTS runs_by_topic ON runs (topic);"
+        )
+        self._conn.commit()
+
+    def start_run(self, run_id: str, topic: str, **info):
+        """ Register a run (a no-op when it is already archived, e.g. on resume) """
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?)", (run_id, topic, time.time(), json.dumps(info)))
+            self._conn.commit()
+            self._topics[run_id] = topic
+
+    def _topic(self, run_id: str):
+        if run_id not in self._topics:
+            row = self._conn.execute("SELECT topic FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            self._topics[run_id] = row[0] if row else None
+        return self._topics[run_id]
+
+    def append(self, run_id: str, kind: str, data, analyst: str = None) -> int:
+        """ Add a record in its own transaction; returns its id """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO records (run_id, topic, analyst, kind, created_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, self._topic(run_id), analyst, kind, time.time(), json.dumps(data, default=str))
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def records(self, run_id: str = None, kind: str = None, analyst: str = None, topic: str = None) -> list:
+        """ Matching records, oldest first, as {"id", "run_id", "topic", "analyst", "kind", "created_at", "data"} """
+        filters = [(column, value) for column, value in (("run_id", run_id), ("kind", kind), ("analyst", analyst), ("topic", topic)) if value is not None]
+        where = " AND ".join(f"{column} = ?" for column, _ in filters) or "1"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, run_id, topic, analyst, kind, created_at, data FROM records WHERE {where} ORDER BY id", [value for _, value in filters]
+            ).fetchall()
+        return [{"id": row[0], "run_id": row[1], "topic": row[2], "analyst": row[3], "kind": row[4], "created_at": row[5], "data": json.loads(row[6])}
+                for row in rows]
+
+    def latest(self, run_id: str, kind: str, analyst: str = None):
+        """ Data of the most recent record of a kind (for an analyst), or None """
+        query = "SELECT data FROM records WHERE run_id = ? AND kind = ? AND analyst IS ? ORDER BY id DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(query, (run_id, kind, analyst)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def latest_by_analyst(self, run_id: str, kind: str) -> dict:
+        """ Data of the most recent record of a kind for each analyst of a run, in the order they were first written """
+        latest = {}
+        for record in self.records(run_id, kind):
+            if record["analyst"] is not None:
+                latest[record["analyst"]] = record["data"]
+        return latest
+
+    def runs(self, topic: str = None) -> list:
+        """ Archived runs, newest first """
+        query = "SELECT run_id, topic, created_at, info FROM runs" + (" WHERE topic = ?" if topic is not None else "") + " ORDER BY created_at DESC"
+        with self._lock:
+            rows = self._conn.execute(query, (topic,) if topic is not None else ()).fetchall()
+        return [{"run_id": row[0], "topic": row[1], "created_at": row[2], **json.loads(row[3])} for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+run_archive = None
+_archive_lock = threading.Lock()
+
+
+def configure_run_archive(path: str = "run_archive.sqlite") -> RunArchive:
+    """ Archive runs to another SQLite file (":memory:" keeps them in memory, e.g. for benchmarks) """
+    global run_archive, run_archive_path
+    with _archive_lock:
+        run_archive_path = path
+        run_archive = RunArchive(path)
+    return run_archive
+
+
+def get_run_archive() -> RunArchive:
+    """ Shared archive, opened at run_archive_path on first use """
+    global run_archive
+    with _archive_lock:
+        if run_archive is None:
+            run_archive = RunArchive(run_archive_path)
+        return run_archive
+
+
+def message_record(message) -> dict:
+    return {"type": message.type, "name": getattr(message, "name", None), "content": message.content}
+
+
+def archive_turn(state: dict, answer, novelty: dict):
+    """ Record a finished question/answer exchange of an interview """
+    if not state.get("run_id"):
+        return
+    get_run_archive().append(state["run_id"], "turn", {
+        "interview_id": state.get("interview_id"),
+        "turn": novelty["turn"],
+        "question": message_record(state["messages"][-1]),
+        "search_query": state.get("search_query"),
+        "answer": message_record(answer),
+        "novelty": novelty,
+    }, analyst=state["analyst"].name)
+
+
+def archive_interview(state: dict):
+    """ Record the full transcript of a finished interview and the documents in its context """
+    if not state.get("run_id"):
+        return
+    archive = get_run_archive()
+    analyst = state["analyst"].name
+    archive.append(state["run_id"], "transcript", {"interview_id": state.get("interview_id"),
+                                                   "messages": [message_record(message) for message in state["messages"]]}, analyst=analyst)
+    archive.append(state["run_id"], "documents", state.get("context") or [], analyst=analyst)
+
+
+def to_html(markdown_text: str) -> str:
+    import markdown
+    return markdown.markdown(markdown_text)
+
+
+def render_run(run_id: str, analyst: str = None, fmt: str = "md") -> str:
+    """ Final report of a run, or one analyst's section, as Markdown or HTML """
+    archive = get_run_archive()
+    if analyst is not None:
+        record = archive.latest(run_id, "section", analyst)
+        text = record["markdown"] if record else None
+    else:
+        record = archive.latest(run_id, "report")
+        text = record["markdown"] if record else None
+    if text is None:
+        raise KeyError(f"Nothing to render for run {run_id!r}" + (f" and analyst {analyst!r}" if analyst else ""))
+    return to_html(text) if fmt == "html" else text
+
+
+def render_transcript(run_id: str, analyst: str) -> str:
+    """ Interview transcript of an analyst, as Markdown """
+    record = get_run_archive().latest(run_id, "transcript", analyst)
+    if record is None:
+        raise KeyError(f"No transcript for analyst {analyst!r} in run {run_id!r}")
+    return "\n\n".join(f"**{message['name'] or message['type']}**: {message['content']}" for message in record["messages"])
+
+
+def export_run(run_id: str, filename: str, analyst: str = None, fmt: str = None) -> str:
+    """ Render a run (or one analyst's section) to a file; the format follows the extension unless given """
+    fmt = fmt or ("html" if filename.endswith(".html") else "md")
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write(render_run(run_id, analyst, fmt))
+    return filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query and render the run archive")
+    parser.add_argument("--archive", default=run_archive_path, help="SQLite file of the archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runs_command = commands.add_parser("runs", help="list the archived runs")
+    runs_command.add_argument("--topic")
+    render_command = commands.add_parser("render", help="print or save the final report of a run, or one analyst's section")
+    render_command.add_argument("run_id")
+    render_command.add_argument("--analyst")
+    render_command.add_argument("--html", action="store_true")
+    render_command.add_argument("--output", "-o")
+    transcript_command = commands.add_parser("transcript", help="print an analyst's interview")
+    transcript_command.add_argument("run_id")
+    transcript_command.add_argument("analyst")
+    args = parser.parse_args()
+
+    configure_run_archive(args.archive)
+    if args.command == "runs":
+        for run in get_run_archive().runs(args.topic):
+            sections = get_run_archive().latest_by_analyst(run["run_id"], "section")
+            print(f"{run['run_id']}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(run['created_at']))}  {len(sections)} section(s)  {run['topic']}")
+    elif args.command == "render":
+        if args.output:
+            print(f"Saved to {export_run(args.run_id, args.output, args.analyst, 'html' if args.html else None)}")
+        else:
+            print(render_run(args.run_id, args.analyst, "html" if args.html else "md"))
+    else:
+        print(render_transcript(args.run_id, args.analyst))
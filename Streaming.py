@@ -0,0 +1,134 @@
+import json
+import threading
+
+# Token-level streaming of questions, answers and sections to pluggable sinks
+
+# Nodes whose LLM output is streamed, with the label shown for them
+STREAMED_NODES = {
+    "ask_question": "Analyst Question",
+    "answer_question": "Expert Answer",
+    "write_section": "Report Section",
+}
+
+
+def is_streaming(config) -> bool:
+    """ True when tokens are being streamed to sinks, so nodes should not print their full output again """
+    return bool(config and config.get("configurable", {}).get("stream_tokens"))
+
+
+class TokenSink:
+    """ Receives tokens as they are generated. Events carry interview_id, analyst, node, label and token """
+
+    def on_token(self, event: dict):
+        pass
+
+    def on_message_end(self, event: dict):
+        pass
+
+    def close(self):
+        pass
+
+
+class ConsoleSink(TokenSink):
+    """ Print tokens to the console as they arrive """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = None
+
+    def on_token(self, event: dict):
+        with self._lock:
+            # Start a new labelled block whenever another interview or node takes over the console
+            key = (event["interview_id"], event["node"])
+            if key != self._current:
+                print(f"\n[{event['label']} - {event['analyst']}]: ", end="")
+                self._current = key
+            print(event["token"], end="", flush=True)
+
+    def on_message_end(self, event: dict):
+        with self._lock:
+            if self._current == (event["interview_id"], event["node"]):
+                print()
+                self._current = None
+
+
+class FileSink(TokenSink):
+    """ Append every event as a JSON line """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _write(self, event: dict):
+        with self._lock:
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+
+    def on_token(self, event: dict):
+        self._write({"event": "token", **event})
+
+    def on_message_end(self, event: dict):
+        self._write({"event": "message_end", **event})
+
+    def close(self):
+        self._file.close()
+
+
+class QueueSink(TokenSink):
+    """ Put events on a queue (queue.Queue or asyncio.Queue via a put callable) for another consumer """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def on_token(self, event: dict):
+        self.queue.put_nowait({"event": "token", **event})
+
+    def on_message_end(self, event: dict):
+        self.queue.put_nowait({"event": "message_end", **event})
+
+
+class _Dispatcher:
+    """ Turn LangGraph stream parts into sink events """
+
+    def __init__(self, sinks, interview_id, analyst):
+        self.sinks = sinks
+        self.base = {"interview_id": interview_id, "analyst": analyst.name}
+        self.final_state = None
+
+    def handle(self, mode, chunk):
+        if mode == "messages":
+            message, metadata = chunk
+            node = metadata.get("langgraph_node")
+            if node in STREAMED_NODES and isinstance(message.content, str) and message.content:
+                event = {**self.base, "node": node, "label": STREAMED_NODES[node], "token": message.content}
+                for sink in self.sinks:
+                    sink.on_token(event)
+        elif mode == "updates":
+            # A node finished, so its message is complete
+            for node in chunk or {}:
+                if node in STREAMED_NODES:
+                    event = {**self.base, "node": node, "label": STREAMED_NODES[node]}
+                    for sink in self.sinks:
+                        sink.on_message_end(event)
+        elif mode == "values":
+            self.final_state = chunk
+
+
+def streaming_config(config: dict) -> dict:
+    return {**config, "configurable": {**config["configurable"], "stream_tokens": True}}
+
+
+def stream_graph(graph, graph_input, config, sinks, interview_id, analyst):
+    """ Run a graph, streaming LLM tokens to the sinks, and return the final state as invoke would """
+    dispatcher = _Dispatcher(sinks, interview_id, analyst)
+    for mode, chunk in graph.stream(graph_input, streaming_config(config), stream_mode=["messages", "updates", "values"]):
+        dispatcher.handle(mode, chunk)
+    return dispatcher.final_state
+
+
+async def astream_graph(graph, graph_input, config, sinks, interview_id, analyst):
+    """ Async version of stream_graph """
+    dispatcher = _Dispatcher(sinks, interview_id, analyst)
+    async for mode, chunk in graph.astream(graph_input, streaming_config(config), stream_mode=["messages", "updates", "values"]):
+        dispatcher.handle(mode, chunk)
+    return dispatcher.final_state
@@ -0,0 +1,280 @@
+import functools
+import hashlib
+import json
+import operator
+import re
+import threading
+from typing import Annotated, List
+from typing_extensions import TypedDict
+from langgraph.graph import START, END, StateGraph
+from langchain_core.messages import HumanMessage, SystemMessage
+from Generate_Analysts import graph_callbacks, analyst_fingerprint
+from Instrumentation import instrument
+from LLM_Clients import chat_model, llm_config
+from Run_Archive import get_run_archive
+
+# Final report: every interview's section merged into one document
+#
+# Map: each interview's write_section already wrote its section. Each one is archived with a content hash as soon as
+# its interview is saved (save_section), so the report can be rebuilt at any time from the run archive.
+# Reduce: the report graph merges the sections into the body, renumbering their citations into one source list, and
+# writes the introduction and the conclusion, all three in parallel. The introduction and conclusion are stored with
+# the hash of the sections they were written from: when one interview is re-run, only that section changes, and they
+# are regenerated only if some section's hash changed. The body is a plain merge, so it costs no LLM call.
+
+_SOURCES_HEADER = re.compile(r"^#{2,3}\s*Sources\s*$", re.MULTILINE | re.IGNORECASE)
+_SOURCE_LINE = re.compile(r"^\s*\[(\d+)\]\s*(.+?)\s*$")
+_CITATION = re.compile(r"\[(\d+(?:\s*,\s*\d+)*)\]")
+
+_sections_lock = threading.Lock()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_sections(thread_id: str) -> dict:
+    """ Latest archived sections and report parts of a run:
+    {"sections": {(analyst name, fingerprint): {...}}, "latest": {analyst name: {...}}, "parts": {part: {...}}} """
+    archive = get_run_archive()
+    sections, latest, parts = {}, {}, {}
+    for record in archive.records(thread_id, "section"):
+        sections[(record["analyst"], record["data"]["fingerprint"])] = latest[record["analyst"]] = record["data"]
+    for record in archive.records(thread_id, "report_part"):
+        parts[record["data"]["part"]] = record["data"]
+    return {"sections": sections, "latest": latest, "parts": parts}
+
+
+def archived_section(thread_id: str, analyst):
+    """ Latest archived section of this analyst persona (same name and fingerprint), or None """
+    fingerprint = analyst_fingerprint(analyst)
+    for record in reversed(get_run_archive().records(thread_id, "section", analyst.name)):
+        if record["data"]["fingerprint"] == fingerprint:
+            return record["data"]
+    return None
+
+
+def save_section(analyst, section: str, thread_id: str) -> str:
+    """ Archive an interview's section with its content hash, unless the persona's latest archived one is the same; returns the hash """
+    digest = content_hash(section)
+    with _sections_lock:
+        archive = get_run_archive()
+        latest = archived_section(thread_id, analyst)
+        if latest is None or latest["hash"] != digest:
+            archive.append(thread_id, "section", {"hash": digest, "fingerprint": analyst_fingerprint(analyst), "markdown": section}, analyst=analyst.name)
+    print(f"Section of {analyst.name} saved to the run archive")
+    return digest
+
+
+def split_section(section: str) -> tuple:
+    """ (text before the Sources header, {citation number: source}) of a section """
+    match = _SOURCES_HEADER.search(section)
+    if not match:
+        return section.strip(), {}
+    sources = {}
+    for line in section[match.end():].splitlines():
+        source = _SOURCE_LINE.match(line)
+        if source:
+            sources[int(source.group(1))] = source.group(2)
+    return section[:match.start()].strip(), sources
+
+
+def merge_sections(sections: List[str]) -> tuple:
+    """ Body of the report and its source list: every section's citations renumbered into one list, each source once """
+    numbers, sources, bodies = {}, [], []
+    for section in sections:
+        text, section_sources = split_section(section)
+        renumber = {}
+        for number, source in sorted(section_sources.items()):
+            key = source.lower().rstrip("/ ")
+            if key not in numbers:
+                sources.append(source)
+                numbers[key] = len(sources)
+            renumber[number] = numbers[key]
+
+        def cite(match):
+            cited = [renumber.get(int(number.strip())) for number in match.group(1).split(",")]
+            if None in cited:
+                return match.group(0)  # Not a citation of this section's sources
+            return "".join(f"[{number}]" for number in dict.fromkeys(cited))
+
+        bodies.append(_CITATION.sub(cite, text))
+    return "\n\n".join(bodies), sources
+
+
+class ReportState(TypedDict):
+    topic: str  # Research topic
+    sections: List[str]  # Section of each interview, in report order
+    section_hashes: List[str]  # Content hash of each section
+    parts: dict  # Introduction and conclusion written earlier, with the hash of the sections they were written from
+    body: str  # Merged sections
+    sources: List[str]  # Renumbered sources of the whole report
+    introduction: str
+    conclusion: str
+    regenerated: Annotated[list, operator.add]  # Parts written by this run (not reused)
+    missing: List[str]  # Analysts with no section of their current persona, left out of the report
+    final_report: str
+
+
+intro_conclusion_instructions = """You are a technical writer finishing a report on {topic}
+
+You will be given all of the sections of the report.
+
+You job is to write a crisp and compelling introduction or conclusion section.
+
+The user will instruct you whether to write the introduction or conclusion.
+
+Include no pre-amble for either section.
+
+Target around 100 words, crisply previewing (for introduction) or recapping (for conclusion) all of the sections of the report.
+
+Use markdown formatting. Do not cite sources.
+
+For your introduction, create a compelling title and use the # header for the title.
+
+For your introduction, use ## Introduction as the section header.
+
+For your conclusion, use ## Conclusion as the section header.
+
+Here are the sections to reflect on for writing: {formatted_str_sections}"""
+
+part_requests = {
+    "introduction": "Write the report introduction",
+    "conclusion": "Write the report conclusion",
+}
+
+
+def parts_key(state: ReportState) -> str:
+    """ What the introduction and conclusion depend on: the topic and every section, in order """
+    return content_hash(json.dumps([state["topic"], state["section_hashes"]]))
+
+
+def _part_prompt(state: ReportState, part: str) -> list:
+    sections = "\n\n".join(split_section(section)[0] for section in state["sections"])
+    system_message = intro_conclusion_instructions.format(topic=state["topic"], formatted_str_sections=sections)
+    return [SystemMessage(content=system_message), HumanMessage(content=part_requests[part])]
+
+
+def _reused(state: ReportState, part: str):
+    stored = (state.get("parts") or {}).get(part) or {}
+    return stored.get("text") if stored.get("key") == parts_key(state) else None
+
+
+def write_part(part: str):
+    """ Node writing the introduction or the conclusion, unless the sections did not change since it was written """
+
+    def node(state: ReportState, config):
+        text = _reused(state, part)
+        if text is not None:
+            return {part: text}
+        text = chat_model(config, role="writing").invoke(_part_prompt(state, part)).content
+        return {part: text, "regenerated": [part]}
+
+    async def anode(state: ReportState, config):
+        text = _reused(state, part)
+        if text is not None:
+            return {part: text}
+        text = (await chat_model(config, role="writing").ainvoke(_part_prompt(state, part))).content
+        return {part: text, "regenerated": [part]}
+
+    return node, anode
+
+
+def merge_body(state: ReportState):
+    """ Node to merge the sections into the report body, with citations renumbered across sections """
+    body, sources = merge_sections(state["sections"])
+    return {"body": body, "sources": sources}
+
+
+def finalize_report(state: ReportState):
+    """ Node to put the introduction, body, conclusion and sources together """
+    report = f"{state['introduction'].strip()}\n\n---\n\n{state['body']}\n\n---\n\n{state['conclusion'].strip()}"
+    if state["sources"]:
+        report += "\n\n## Sources\n" + "\n".join(f"[{number}] {source}  " for number, source in enumerate(state["sources"], 1))
+    return {"final_report": report}
+
+
+def add_report_flow(builder: StateGraph):
+    """ Merge the body and write the introduction and conclusion in parallel, then finalize """
+    for node in ("merge_body", "write_introduction", "write_conclusion"):
+        builder.add_edge(START, node)
+    builder.add_edge(["merge_body", "write_introduction", "write_conclusion"], "finalize_report")
+    builder.add_edge("finalize_report", END)
+
+
+@functools.lru_cache(maxsize=None)
+def get_report_graph(asynchronous: bool = False):
+    """ Build and compile the report graph on first use (the async one writes the introduction and conclusion with async calls) """
+    builder = StateGraph(ReportState)
+    for part in ("introduction", "conclusion"):
+        node, anode = write_part(part)
+        builder.add_node(f"write_{part}", instrument("report", f"write_{part}", anode if asynchronous else node))
+    builder.add_node("merge_body", instrument("report", "merge_body", merge_body))
+    builder.add_node("finalize_report", instrument("report", "finalize_report", finalize_report))
+    add_report_flow(builder)
+    return builder.compile().with_config(run_name="Write report (async)" if asynchronous else "Write report")
+
+
+def report_input(topic: str, thread_id: str, analysts=None) -> dict:
+    """ Input of the report graph from the archived sections: those of the analysts' current personas, in their order,
+    when analysts are given (a section written by a revised or dropped persona is never used), else each analyst's latest """
+    store = load_sections(thread_id)
+    missing = []
+    if analysts is None:
+        sections = list(store["latest"].values())
+    else:
+        sections = []
+        for analyst in analysts:
+            section = store["sections"].get((analyst.name, analyst_fingerprint(analyst)))
+            if section is None:
+                missing.append(analyst.name)
+            else:
+                sections.append(section)
+    if missing:
+        print(f"No section for {', '.join(missing)} (interview failed or not run yet): left out of the report")
+    return {
+        "topic": topic,
+        "sections": [section["markdown"] for section in sections],
+        "section_hashes": [section["hash"] for section in sections],
+        "parts": store.get("parts", {}),
+        "regenerated": [],
+        "missing": missing,
+    }
+
+
+def save_final_report(result: dict, thread_id: str) -> str:
+    """ Archive the regenerated introduction and conclusion with the sections they reflect, and the final report """
+    archive = get_run_archive()
+    key = parts_key(result)
+    for part in result.get("regenerated") or []:
+        archive.append(thread_id, "report_part", {"part": part, "key": key, "text": result[part]})
+    archive.append(thread_id, "report", {"key": key, "section_hashes": result["section_hashes"], "sources": result["sources"],
+                                         "missing": result.get("missing") or [], "markdown": result["final_report"]})
+
+    regenerated = ", ".join(result.get("regenerated") or []) or "nothing"
+    print(f"Final report saved to the run archive ({len(result['sections'])} sections, {len(result['sources'])} sources, regenerated: {regenerated})")
+    return result["final_report"]
+
+
+def report_config(llm_model: str, llm_temperature: float) -> dict:
+    return {"configurable": llm_config(llm_model, llm_temperature), "callbacks": list(graph_callbacks)}
+
+
+def write_report(topic: str, thread_id: str, llm_model: str, llm_temperature: float, analysts=None):
+    """ Write (or bring up to date) the final report of a run from its archived sections; returns its Markdown """
+    graph_input = report_input(topic, thread_id, analysts)
+    if not graph_input["sections"]:
+        print("No sections to write a report from")
+        return None
+    result = get_report_graph().invoke(graph_input, report_config(llm_model, llm_temperature))
+    return save_final_report(result, thread_id)
+
+
+async def awrite_report(topic: str, thread_id: str, llm_model: str, llm_temperature: float, analysts=None):
+    """ Async version of write_report """
+    graph_input = report_input(topic, thread_id, analysts)
+    if not graph_input["sections"]:
+        print("No sections to write a report from")
+        return None
+    result = await get_report_graph(asynchronous=True).ainvoke(graph_input, report_config(llm_model, llm_temperature))
+    return save_final_report(result, thread_id)
@@ -1,20 +1,124 @@
-from Conduct_Interviews import *
+import argparse
 import uuid  #to generate random thread IDs
 
-# create a random thread ID
-thread_id = str(uuid.uuid4())
-
 #LLM Inputs
 llm_model = "gpt-4o-mini"
 llm_temperature = 0.5
+llm_cache_mode = "off"  # "record" to save every LLM response, "replay" to re-run offline from saved responses
+# Model per role; a list is a cascade that escalates when structured output fails validation (None = llm_model)
+model_tiers = {
+    "query": ["gpt-4.1-nano", None],
+    "review": ["gpt-4.1-nano", None],
+}
 
 # INPUTS
 topic = "Key success factors for ice cream business"
 max_analysts = 5
 max_questions = 5
+max_concurrency = 5  # Number of interviews running at the same time
+use_async = False  # Drive the whole pipeline from one asyncio event loop
+stream_tokens = False  # Print questions, answers and sections token by token as they are generated
+review_feedback = None  # "console", "http://127.0.0.1:8765" or a file path: review the analysts while their interviews already run
+review_timeout = 900  # Seconds to wait for each round of review feedback before accepting the draft (None waits indefinitely)
+prefetch_retrieval = False  # Search for the likely next question while the expert answers (spends extra search quota)
+checkpoint_db = None  # e.g. "checkpoints.sqlite" to keep graph checkpoints on disk (sync path only)
+run_archive_file = "run_archive.sqlite"  # Analysts, interviews, sections and reports of every run (render them with Run_Archive.py)
+metrics_file = "metrics.jsonl"  # Per-node timing and token events, one JSON object per line (None to turn off)
+
+parser = argparse.ArgumentParser(description="Generate analysts and run their interviews")
+parser.add_argument("--resume", metavar="THREAD_ID", help="resume an earlier run: reuse its analysts, skip finished reports and continue unfinished interviews")
+parser.add_argument("--checkpoint-db", default=checkpoint_db, help="SQLite file for durable checkpoints")
+args = parser.parse_args()
+
+# The pipeline modules are imported after the arguments are parsed, so --help answers immediately
+from Conduct_Interviews import *
+from LLM_Cache import configure_llm_cache
+from Document_Store import configure_document_sharing
+from Checkpoints import make_checkpointer
+from Streaming import ConsoleSink
+from Instrumentation import enable_metrics, metrics
+from Rate_Limits import scheduler_stats
+from LLM_Clients import set_model_tiers
+from Prefetch import configure_prefetch
+from Analyst_Review import review_and_interview, make_feedback_source
+from Write_Report import write_report, awrite_report, archived_section
+from Run_Archive import configure_run_archive, get_run_archive, export_run
+
+# Serve repeated LLM calls from llm_cache.sqlite
+configure_llm_cache(llm_cache_mode)
+
+# Borrowed documents depend on which interview retrieved them first, so recorded runs would not replay: answer from each interview's own documents then
+configure_document_sharing(llm_cache_mode == "off")
+
+# Cheap, high-volume roles run on a smaller model
+set_model_tiers(model_tiers)
+
+# Overlap the next turn's searches with the current answer
+configure_prefetch(prefetch_retrieval)
+
+# Every run's outputs go to one append-only archive
+configure_run_archive(run_archive_file)
+
+# Resuming needs the checkpoints of the earlier run, so they are always kept on disk then
+checkpoint_db = args.checkpoint_db or ("checkpoints.sqlite" if args.resume else None)
+if checkpoint_db:
+    checkpointer = make_checkpointer(checkpoint_db)
+    set_analysts_checkpointer(checkpointer)
+    set_interview_checkpointer(checkpointer)
+
+# create a random thread ID, or reuse the one of the run being resumed
+thread_id = args.resume or str(uuid.uuid4())
+print(f"Thread ID: {thread_id}")
+
+sinks = [ConsoleSink()] if stream_tokens else None
+
+if metrics_file:
+    enable_metrics(metrics_file)
+
+
+async def amain():
+    analysts = await arun_graph(topic, max_analysts, llm_model, llm_temperature, thread_id)
+    await aconduct_interviews(analysts, topic, max_questions, thread_id, llm_model, llm_temperature, max_concurrency, sinks=sinks)
+    await awrite_report(topic, thread_id, llm_model, llm_temperature, analysts)
+
+
+if use_async and not args.resume:
+    asyncio.run(amain())
+elif review_feedback and not args.resume:
+    # Interviews start with the first draft; revised analysts are re-interviewed, the others keep going
+    analysts, reports = review_and_interview(topic, max_analysts, max_questions, thread_id, llm_model, llm_temperature,
+                                             make_feedback_source(review_feedback), max_concurrency, sinks=sinks,
+                                             review_timeout=review_timeout)
+    write_report(topic, thread_id, llm_model, llm_temperature, analysts)
+else:
+    # Step 1: Generate list of Analysts and archive them for replicability (or reuse the archived list)
+    analysts = load_analysts(thread_id) if args.resume else None
+    if analysts is not None:
+        print(f"Reusing analysts from {run_archive_file}")
+    else:
+        analysts = run_graph(topic, max_analysts, llm_model, llm_temperature, thread_id)
+
+    # Skip analysts whose sections were already archived
+    remaining = analysts
+    if args.resume:
+        remaining = [analyst for analyst in analysts if archived_section(thread_id, analyst) is None]
+        print(f"{len(remaining)} interview(s) left to run")
+
+    # Step 2: The analysts will ask questions to the expert who has access to the web and documents
+    conduct_interviews(remaining, topic, max_questions, thread_id, llm_model, llm_temperature, max_concurrency, sinks=sinks)
+
+    # Step 3: Combine every analyst's section into the final report (only what changed is rewritten)
+    write_report(topic, thread_id, llm_model, llm_temperature, analysts)
+
+# Render the final report from the archive
+if get_run_archive().latest(thread_id, "report") is not None:
+    print(f"Final report saved to {export_run(thread_id, f'final_report_{thread_id}.md')}")
 
-# Step 1: Generate list of Analysts and save to a JSON file for replicability
-analysts = run_graph(topic, max_analysts, llm_model, llm_temperature, thread_id)
+# Where the time and tokens went
+if metrics_file:
+    summary = metrics.summary()
+    get_run_archive().append(thread_id, "metrics", summary)
+    print(json.dumps(summary, indent=4))
 
-# Step 2: The analysts will ask questions to the expert who has access to the web and documents
-for analyst in analysts: conduct_interview_with_analyst(analyst, topic, max_questions, thread_id, llm_model, llm_temperature)
\ No newline at end of file
+# How often the APIs throttled us
+print(json.dumps(scheduler_stats(), indent=4))